@@ -1,28 +1,110 @@
+import logging
+import os
+from threading import Lock
+from typing import Dict, Optional
+
 from sqlalchemy import create_engine, event
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
 
 from .config import get_config
 
+config = get_config()
 
-def _fk_pragma_on_connect(e: Engine, _):
-    e.execute("pragma foreign_keys=ON")
+logger = logging.getLogger(__name__)
 
+# WAL lets the readers keep going while the writer holds its lock
+SQLITE_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "mmap_size": 268435456,
+    "cache_size": -16000,
+    "busy_timeout": 5000,
+}
+
+
+def sqlite_pragmas() -> Dict:
+    return {**SQLITE_PRAGMAS, **(config.get("sqlite_pragmas") or {})}
+
+
+def create_sqlite_engine(
+    path: str,
+    pool_size: int = 1,
+    query_only: bool = False,
+    pragmas: Optional[Dict] = None,
+) -> Engine:
+    pragmas = sqlite_pragmas() if pragmas is None else pragmas
+
+    # a pool of one is a single writer, others wait for it in the pool
+    # instead of failing with SQLITE_BUSY
+    engine = create_engine(
+        f"sqlite:///{os.path.join('.', path)}",
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=0,
+    )
+
+    def on_connect(connection, _):
+        connection.execute("pragma foreign_keys=ON")
+
+        for name, value in pragmas.items():
+            connection.execute(f"pragma {name}={value}")
+
+        if query_only:
+            connection.execute("pragma query_only=ON")
+
+    event.listen(engine, "connect", on_connect)
+
+    return engine
 
-config = get_config()
 
 SQLALCHEMY_DATABASE_URI: str = f"sqlite:///./{config['sqlite_db']}"
 
-engine: Engine = create_engine(
-    SQLALCHEMY_DATABASE_URI, connect_args={"check_same_thread": False}
+# every write goes through this engine's one connection
+engine: Engine = create_sqlite_engine(config["sqlite_db"])
+
+read_engine: Engine = create_sqlite_engine(
+    config["sqlite_db"],
+    pool_size=int(config.get("sqlite_readers", 4)),
+    query_only=True,
 )
 
-event.listen(engine, "connect", _fk_pragma_on_connect)
+# inode of the database file the pool was opened against
+database_inode: Optional[int] = None
+database_lock = Lock()
+
+
+def reopen_if_replaced() -> None:
+    global database_inode
+
+    # a rebuild swaps in a new file, pooled connections still see the old one
+    try:
+        inode = os.stat(config["sqlite_db"]).st_ino
+    except OSError:
+        return
+
+    if inode == database_inode:
+        return
+
+    with database_lock:
+        if database_inode is not None and inode != database_inode:
+            logger.info("Database file was replaced, reopening connections")
+            engine.dispose()
+            read_engine.dispose()
+
+        database_inode = inode
 
 
 SessionLocal: Session = sessionmaker(
     autocommit=False, autoflush=False, bind=engine
 )
 
+# read-only endpoints, these connections refuse writes
+ReadSessionLocal: Session = sessionmaker(
+    autocommit=False, autoflush=False, bind=read_engine
+)
+
 Base = declarative_base()
@@ -0,0 +1,454 @@
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+from time import perf_counter
+from timeit import timeit
+from typing import Dict, List
+
+import click
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+
+from . import migrations, models, schemas, utils
+from .base_db import create_sqlite_engine, sqlite_pragmas
+from .crud import movies_crud
+from .filesystem import (
+    FILESYSTEM_ROOTS,
+    DirectoryFilesystem,
+    Filesystem,
+    MemoryFilesystem,
+)
+from .links import LinkPlan
+from .writes import WriteQueue
+
+PARSE_INPUTS = {
+    "well formed": lambda n: "[Studio] {Series 2} "
+    + "Name " * (n // 5)
+    + "(Actor A, Actor B).mp4",
+    "unclosed studio": lambda n: "[" + "a" * n,
+    "unclosed series": lambda n: "{" + "a 1 " * (n // 4),
+    "actor commas": lambda n: "Name (" + "a, " * (n // 3) + ")",
+    "unclosed actors": lambda n: "a " * (n // 2) + "(" + "b, " * (n // 3),
+    "invalid tail": lambda n: "[S] {X 1} " + "a " * (n // 2) + "_",
+}
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+def parse():
+    """Time parse_filename on growing well and badly formed filenames."""
+    for label, generate in PARSE_INPUTS.items():
+        for length in (100, 1000, 10000):
+            filename = generate(length)
+            runs = max(10, 100000 // length)
+
+            seconds = timeit(
+                lambda: utils.parse_filename(filename), number=runs
+            )
+
+            click.echo(
+                f"{label:>16} {len(filename):>6} chars: "
+                f"{seconds / runs * 1e6:9.1f}us"
+            )
+
+
+def path_operations(paths: Dict[str, str], names: List[str]) -> None:
+    for name in names:
+        movie = f"{paths['movies']}/{name}"
+        link = f"{paths['actors']}/Actor/{name}"
+
+        os.symlink(movie, link)
+        os.path.lexists(link)
+        os.rename(movie, f"{movie}.tmp")
+        os.rename(f"{movie}.tmp", movie)
+        os.remove(link)
+
+
+def filesystem_operations(filesystem: Filesystem, names: List[str]) -> None:
+    for name in names:
+        link = f"Actor/{name}"
+
+        filesystem.symlink(filesystem.path("movies", name), "actors", link)
+        filesystem.lexists("actors", link)
+        filesystem.rename("movies", name, "movies", f"{name}.tmp")
+        filesystem.rename("movies", f"{name}.tmp", "movies", name)
+        filesystem.remove("actors", link)
+
+
+def plan_links(filesystem: Filesystem, names: List[str]) -> LinkPlan:
+    plan = LinkPlan(filesystem=filesystem)
+
+    for name in names:
+        plan.move("movies", name, "movies", f"Renamed {name}")
+        plan.actor(f"Renamed {name}", "Actor", True)
+
+    return plan
+
+
+@cli.command()
+@click.option("--files", default=2000, help="Movie files to operate on")
+@click.option("--depth", default=24, help="Directory levels above the roots")
+def filesystem(files: int, depth: int):
+    """Time path based and dir_fd based link operations on a deep path."""
+    names = [f"Movie {i} (Actor {i % 50}).mp4" for i in range(files)]
+
+    with tempfile.TemporaryDirectory() as base:
+        path = os.path.join(base, *(f"level {i}" for i in range(depth)))
+        paths = {root: f"{path}/{root}" for root in FILESYSTEM_ROOTS}
+
+        for root_path in paths.values():
+            os.makedirs(root_path)
+
+        os.mkdir(f"{paths['actors']}/Actor")
+
+        for name in names:
+            open(f"{paths['movies']}/{name}", "w").close()
+
+        directory = DirectoryFilesystem(paths)
+
+        try:
+            by_path = timeit(lambda: path_operations(paths, names), number=3)
+            by_fd = timeit(
+                lambda: filesystem_operations(directory, names), number=3
+            )
+
+            started = perf_counter()
+            plan_links(directory, names).apply()
+            plan_directory = perf_counter() - started
+        finally:
+            directory.close()
+
+    memory = MemoryFilesystem(paths)
+
+    for name in names:
+        memory.create_file("movies", name)
+
+    started = perf_counter()
+    plan_links(memory, names).apply()
+    plan_memory = perf_counter() - started
+
+    operations = files * 5 * 3
+    click.echo(f"{files} files {depth} levels deep ({len(path)} chars)")
+    click.echo(
+        f"     paths {by_path / operations * 1e6:7.2f}us per operation\n"
+        f"    dir_fd {by_fd / operations * 1e6:7.2f}us per operation"
+    )
+    click.echo(
+        f"  LinkPlan {plan_directory * 1e3:7.1f}ms on disk, "
+        f"{plan_memory * 1e3:.1f}ms in memory"
+    )
+
+    if memory.listdir("actors", "Actor") != [
+        f"Renamed {name}" for name in names
+    ]:
+        click.echo("in-memory plan did not leave the expected links")
+        sys.exit(1)
+
+
+def legacy_sqlite_engine(path: str):
+    # the engine base_db used to create: default pool, rollback journal
+    engine = create_engine(
+        f"sqlite:///{path}", connect_args={"check_same_thread": False}
+    )
+    event.listen(
+        engine,
+        "connect",
+        lambda connection, _: connection.execute("pragma foreign_keys=ON"),
+    )
+
+    return engine
+
+
+def fill_database(path: str, movies: int, pragmas: Dict) -> None:
+    engine = create_sqlite_engine(path, pragmas=pragmas)
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as connection:
+        connection.execute(
+            models.Movie.__table__.insert(),
+            [
+                {
+                    "filename": f"Movie {i}.mp4",
+                    "name": f"Movie {i}",
+                    "sort_name": f"movie {i}",
+                    "processed": i % 2 == 0,
+                }
+                for i in range(movies)
+            ],
+        )
+
+    engine.dispose()
+
+
+def run_load(
+    read_engine, write_engine, movies: int, readers: int, seconds, hold
+):
+    stop = threading.Event()
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def count(key: str) -> None:
+        with lock:
+            counts[key] += 1
+
+    def read() -> None:
+        while not stop.is_set():
+            try:
+                with read_engine.connect() as connection:
+                    connection.execute(
+                        text("select * from movies where id = :id"),
+                        {"id": random.randint(1, movies)},
+                    ).all()
+                count("reads")
+            except OperationalError:
+                count("errors")
+
+    def write() -> None:
+        # a rename cascade: many rows and slow file work in one transaction
+        while not stop.is_set():
+            try:
+                with write_engine.begin() as connection:
+                    connection.execute(
+                        text(
+                            "update movies set sort_name = sort_name "
+                            "where id % 4 = :n"
+                        ),
+                        {"n": counts["writes"] % 4},
+                    )
+                    stop.wait(hold)
+                count("writes")
+            except OperationalError:
+                count("errors")
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    threads.append(threading.Thread(target=write))
+
+    for thread in threads:
+        thread.start()
+
+    stop.wait(seconds)
+    stop.set()
+
+    for thread in threads:
+        thread.join()
+
+    return counts
+
+
+@cli.command()
+@click.option("--movies", default=20000, help="Rows in the movies table")
+@click.option("--readers", default=4, help="Concurrent reader threads")
+@click.option("--seconds", default=5.0, help="Duration of each run")
+@click.option("--hold", default=0.2, help="Seconds a write transaction lasts")
+def database(movies: int, readers: int, seconds: float, hold: float):
+    """Measure read throughput while a writer keeps the database busy."""
+    with tempfile.TemporaryDirectory() as base:
+        path = os.path.join(base, "legacy.db")
+        fill_database(path, movies, {"journal_mode": "delete"})
+        engine = legacy_sqlite_engine(path)
+        legacy = run_load(engine, engine, movies, readers, seconds, hold)
+        engine.dispose()
+
+        path = os.path.join(base, "wal.db")
+        fill_database(path, movies, sqlite_pragmas())
+        writer = create_sqlite_engine(path)
+        reader = create_sqlite_engine(path, pool_size=readers, query_only=True)
+        wal = run_load(reader, writer, movies, readers, seconds, hold)
+        writer.dispose()
+        reader.dispose()
+
+    click.echo(f"{movies} movies, {readers} readers, {hold}s writes")
+
+    for label, counts in (("rollback", legacy), ("wal", wal)):
+        click.echo(
+            f"  {label:>8} {counts['reads'] / seconds:9.0f} reads/s "
+            f"{counts['writes'] / seconds:6.1f} writes/s "
+            f"{counts['errors']} errors"
+        )
+
+
+def toggle_category(db: Session, movie_id: int, category_id: int) -> None:
+    movie = db.get(models.Movie, movie_id)
+    category = db.get(models.Category, category_id)
+
+    if category in movie.categories:
+        movie.categories.remove(category)
+    else:
+        movie.categories.append(category)
+
+    db.flush()
+
+
+def run_toggles(submit, writers: int, writes: int, movies: int) -> float:
+    def write(n: int) -> None:
+        for i in range(writes):
+            submit((n * writes + i) % movies + 1, i % 4 + 1)
+
+    threads = [
+        threading.Thread(target=write, args=(n,)) for n in range(writers)
+    ]
+    started = perf_counter()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return perf_counter() - started
+
+
+@cli.command()
+@click.option("--movies", default=1000, help="Rows in the movies table")
+@click.option("--writers", default=16, help="Concurrent writer threads")
+@click.option("--writes", default=50, help="Category toggles per writer")
+def writes(movies: int, writers: int, writes: int):
+    """Time bursts of tag toggles committed alone and in batches."""
+    with tempfile.TemporaryDirectory() as base:
+        path = os.path.join(base, "movies.db")
+        fill_database(path, movies, sqlite_pragmas())
+        engine = create_sqlite_engine(path)
+        session_factory = sessionmaker(bind=engine, autoflush=False)
+
+        with engine.begin() as connection:
+            connection.execute(
+                models.Category.__table__.insert(),
+                [{"name": f"Category {i}"} for i in range(4)],
+            )
+
+        def commit_alone(movie_id: int, category_id: int) -> None:
+            db = session_factory()
+
+            try:
+                toggle_category(db, movie_id, category_id)
+                db.commit()
+            finally:
+                db.close()
+
+        queue = WriteQueue(session_factory=session_factory)
+        batches = []
+        apply = queue.apply
+
+        def count_batch(batch) -> None:
+            batches.append(len(batch))
+            apply(batch)
+
+        queue.apply = count_batch
+
+        def commit_batched(movie_id: int, category_id: int) -> None:
+            queue.submit(lambda db: toggle_category(db, movie_id, category_id))
+
+        alone = run_toggles(commit_alone, writers, writes, movies)
+        batched = run_toggles(commit_batched, writers, writes, movies)
+        queue.stop()
+        engine.dispose()
+
+    total = writers * writes
+    click.echo(f"{total} toggles from {writers} threads")
+    click.echo(
+        f"     alone {total / alone:8.0f} writes/s, {total} commits\n"
+        f"   batched {total / batched:8.0f} writes/s, {len(batches)} commits "
+        f"(largest {max(batches)})"
+    )
+
+
+def list_movies_orm(db: Session) -> bytes:
+    # what the endpoint did before: orm objects, pydantic, then json
+    movies = [
+        schemas.MovieFile.from_orm(movie)
+        for movie in movies_crud.get_all_movies(db)
+    ]
+
+    return json.dumps(jsonable_encoder(movies)).encode()
+
+
+MOVIE_LISTS = {
+    "orm": list_movies_orm,
+    "projected": movies_crud.get_movie_files_json,
+}
+
+
+def read_rss() -> Dict[str, int]:
+    with open("/proc/self/status") as f:
+        return {
+            name: int(value.split()[0])
+            for name, value in (line.split(":", 1) for line in f)
+            if name in ("VmRSS", "VmHWM")
+        }
+
+
+def measure_movie_list(path: str, variant: str, runs: int, results) -> None:
+    # a fresh process per variant, its rss high-water mark reset after the
+    # imports (linux only)
+    engine = create_sqlite_engine(path)
+    session_factory = sessionmaker(bind=engine)
+    timings = []
+
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+    baseline = read_rss()["VmRSS"]
+
+    for _ in range(runs):
+        with session_factory() as db:
+            started = perf_counter()
+            body = MOVIE_LISTS[variant](db)
+            timings.append(perf_counter() - started)
+
+    peak = read_rss()["VmHWM"]
+    engine.dispose()
+
+    results.put((variant, min(timings), peak - baseline, len(body)))
+
+
+@cli.command("movie-list")
+@click.option("--movies", default=100000, help="Rows in the movies table")
+@click.option("--runs", default=3, help="Timed runs, the fastest counts")
+def movie_list(movies: int, runs: int):
+    """Compare the ORM and the column-projected GET /movies."""
+    context = multiprocessing.get_context("spawn")
+
+    with tempfile.TemporaryDirectory() as base:
+        path = os.path.join(base, "movies.db")
+        fill_database(path, movies, sqlite_pragmas())
+        engine = create_sqlite_engine(path)
+
+        with engine.begin() as connection:
+            connection.execute(
+                models.Studio.__table__.insert(),
+                [{"name": f"S{i}", "sort_name": f"s{i}"} for i in range(500)],
+            )
+            connection.exec_driver_sql(
+                "update movies set studio_id = id % 500 + 1"
+            )
+
+        migrations.migrate(engine)
+        engine.dispose()
+
+        for variant in MOVIE_LISTS:
+            results = context.Queue()
+            process = context.Process(
+                target=measure_movie_list, args=(path, variant, runs, results)
+            )
+            process.start()
+            variant, elapsed, rss, size = results.get()
+            process.join()
+
+            click.echo(
+                f"{variant:>10} {elapsed * 1e3:8.1f}ms "
+                f"{rss / 1024:7.1f}MB peak rss growth, {size} bytes"
+            )
+
+
+if __name__ == "__main__":
+    cli()
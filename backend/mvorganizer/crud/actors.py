@@ -2,7 +2,7 @@ import logging
 from sqlite3 import IntegrityError
 from typing import List
 
-from sqlalchemy import func
+from sqlalchemy import delete, exc, func, select, update
 from sqlalchemy.orm import Session
 
 from .. import models
@@ -82,3 +82,51 @@ def update_actor(
         raise DuplicateEntryException(f"Actor {name} already exists")
 
     return actor
+
+
+def get_actor_movie_ids(db: Session, actor_id: int) -> List[int]:
+    return list(
+        db.scalars(
+            select(models.movies_actors.c.movie_id).where(
+                models.movies_actors.c.actor_id == actor_id
+            )
+        )
+    )
+
+
+def rename_actor(db: Session, actor: models.Actor, name: str) -> None:
+    # flushed only, the caller commits once the files are renamed too
+    actor.name = name
+
+    try:
+        db.flush()
+    except exc.IntegrityError:
+        db.rollback()
+
+        raise DuplicateEntryException(f"Actor {name} already exists")
+
+
+def merge_actor(
+    db: Session, actor: models.Actor, target: models.Actor
+) -> None:
+    movies_actors = models.movies_actors
+
+    # movies that have both only lose the duplicate, the others move over
+    db.execute(
+        delete(movies_actors).where(
+            movies_actors.c.actor_id == actor.id,
+            movies_actors.c.movie_id.in_(
+                select(movies_actors.c.movie_id).where(
+                    movies_actors.c.actor_id == target.id
+                )
+            ),
+        )
+    )
+    db.execute(
+        update(movies_actors)
+        .where(movies_actors.c.actor_id == actor.id)
+        .values(actor_id=target.id)
+    )
+    db.delete(actor)
+    db.flush()
+    db.expire_all()
@@ -2,7 +2,7 @@ import logging
 from sqlite3 import IntegrityError
 from typing import List, Optional
 
-from sqlalchemy import func
+from sqlalchemy import exc, func
 from sqlalchemy.orm import Session
 
 from .. import models
@@ -70,24 +70,13 @@ def delete_category(db: Session, category_id: int) -> models.Category:
     return category
 
 
-def update_category(
-    db: Session,
-    id: int,
-    name: str,
-) -> models.Category:
-    category = get_category(db, id)
-
-    if category is None:
-        raise InvalidIDException(f"Category ID {id} does not exist")
-
+def rename_category(db: Session, category: models.Category, name: str) -> None:
+    # flushed only, the caller commits once the links are renamed too
     category.name = name
 
     try:
-        db.commit()
-        db.refresh(category)
-    except IntegrityError:
+        db.flush()
+    except exc.IntegrityError:
         db.rollback()
 
         raise DuplicateEntryException(f"Category {name} already exists")
-
-    return category
@@ -3,10 +3,17 @@ from sqlite3 import IntegrityError
 from typing import List, Optional
 
 from sqlalchemy import func
-from sqlalchemy.orm import Session
-
-from .. import models, schemas, utils
+from sqlalchemy.orm import (
+    Session,
+    joinedload,
+    load_only,
+    raiseload,
+    selectinload,
+)
+
+from .. import journal, models, schemas, utils
 from ..exceptions import DuplicateEntryException, InvalidIDException
+from ..links import LinkPlan
 from .actors import get_actor_by_id
 from .categories import get_category
 from .series import get_series
@@ -14,10 +21,41 @@ from .studios import get_studio_by_id
 
 logger = logging.getLogger(__name__)
 
+# what each kind of caller reads from a movie, loaded up front so the
+# number of queries does not grow with its actors and categories
+MOVIE_PROFILES = {
+    # the movie list, anything else would be a query per movie
+    "summary": (
+        load_only(
+            models.Movie.id, models.Movie.filename, models.Movie.fs_pending
+        ),
+        raiseload("*"),
+    ),
+    # schemas.Movie, one movie with its studio and series joined in
+    "detail": (
+        selectinload(models.Movie.actors),
+        selectinload(models.Movie.categories),
+        joinedload(models.Movie.series),
+        joinedload(models.Movie.studio),
+    ),
+    # generate_movie_filename and the links of every tree, for many movies
+    # sharing a few studios and series
+    "rename": (
+        selectinload(models.Movie.actors),
+        selectinload(models.Movie.categories),
+        selectinload(models.Movie.series),
+        selectinload(models.Movie.studio),
+    ),
+}
+
+
+def query_movies(db: Session, profile: str):
+    return db.query(models.Movie).options(*MOVIE_PROFILES[profile])
+
 
 def get_all_movies(db: Session) -> List[models.Movie]:
     return (
-        db.query(models.Movie)
+        query_movies(db, "summary")
         .outerjoin(models.Studio)
         .outerjoin(models.Series)
         .order_by(
@@ -30,8 +68,71 @@ def get_all_movies(db: Session) -> List[models.Movie]:
     )
 
 
-def get_movie_by_id(db: Session, movie_id: int) -> models.Movie:
-    return db.query(models.Movie).filter(models.Movie.id == movie_id).first()
+# one json object per movie, built by sqlite in get_all_movies' order
+MOVIE_FILES_JSON = """
+select json_object(
+    'id', movies.id,
+    'filename', movies.filename,
+    'fs_pending', json(iif(exists (
+        select 1 from fs_journal where fs_journal.movie_id = movies.id
+    ), 'true', 'false'))
+)
+from movies
+left outer join studios on studios.id = movies.studio_id
+left outer join series on series.id = movies.series_id
+order by
+    movies.processed,
+    studios.sort_name,
+    series.sort_name,
+    movies.sort_name
+"""
+
+
+def get_movie_files_json(db: Session) -> bytes:
+    # schemas.MovieFile as json bytes, the dbapi cursor skips sqlalchemy's
+    # row objects and nothing passes through the orm or pydantic
+    cursor = db.connection().connection.cursor()
+
+    try:
+        movies = ",".join(movie for movie, in cursor.execute(MOVIE_FILES_JSON))
+    finally:
+        cursor.close()
+
+    return f"[{movies}]".encode()
+
+
+def get_movies_with_properties(db: Session, *criteria) -> List[models.Movie]:
+    return query_movies(db, "rename").filter(*criteria).all()
+
+
+def get_movies_by_ids(db: Session, movie_ids: List[int]) -> List[models.Movie]:
+    return get_movies_with_properties(db, models.Movie.id.in_(movie_ids))
+
+
+def get_movies_by_series(db: Session, series_id: int) -> List[models.Movie]:
+    return get_movies_with_properties(db, models.Movie.series_id == series_id)
+
+
+def get_movies_by_studio(db: Session, studio_id: int) -> List[models.Movie]:
+    return get_movies_with_properties(db, models.Movie.studio_id == studio_id)
+
+
+def get_movie_by_id(
+    db: Session, movie_id: int, profile: str = "detail"
+) -> models.Movie:
+    return (
+        query_movies(db, profile).filter(models.Movie.id == movie_id).first()
+    )
+
+
+def refresh_movie(db: Session, movie: models.Movie) -> models.Movie:
+    # db.refresh would lazy load every relationship again on its own
+    return (
+        query_movies(db, "detail")
+        .populate_existing()
+        .filter(models.Movie.id == movie.id)
+        .one()
+    )
 
 
 def get_movie_by_name(db: Session, name: str) -> models.Movie:
@@ -98,58 +199,66 @@ def update_movie(
     if movie.name != data.name:
         movie.sort_name = utils.generate_sort_name(data.name)
 
+    # every link change of the edit is applied together at the end
+    plan = LinkPlan()
+
     if movie.series_id != data.series_id:
         series_current = (
-            get_series(db, movie.series_id).name
-            if movie.series_id is not None
-            else None
+            movie.series.name if movie.series is not None else None
         )
-        series_new = (
-            get_series(db, data.series_id).name
+        series = (
+            get_series(db, data.series_id)
             if data.series_id is not None
             else None
         )
+        series_new = series.name if series is not None else None
 
         if data.series_id is None:
-            utils.update_series_link(movie.filename, series_current, False)
+            plan.series(movie.filename, series_current, False)
         elif movie.series_id is None:
             # add series
-            utils.update_series_link(movie.filename, series_new, True)
+            plan.series(movie.filename, series_new, True)
         else:
             # change series
-            utils.update_series_link(movie.filename, series_current, False)
-            utils.update_series_link(movie.filename, series_new, True)
+            plan.series(movie.filename, series_current, False)
+            plan.series(movie.filename, series_new, True)
+
+        # the loaded relationship would not follow series_id
+        movie.series = series
 
     if movie.studio_id != data.studio_id:
         studio_current = (
-            get_studio_by_id(movie.studio_id, db).name
-            if movie.studio_id is not None
-            else None
+            movie.studio.name if movie.studio is not None else None
         )
-        studio_new = (
-            get_studio_by_id(data.studio_id, db).name
+        studio = (
+            get_studio_by_id(data.studio_id, db)
             if data.studio_id is not None
             else None
         )
+        studio_new = studio.name if studio is not None else None
 
         if data.studio_id is None:
             # remove studio
-            utils.update_studio_link(movie.filename, studio_current, False)
+            plan.studio(movie.filename, studio_current, False)
         elif movie.studio_id is None:
             # add studio
-            utils.update_studio_link(movie.filename, studio_new, True)
+            plan.studio(movie.filename, studio_new, True)
         else:
             # change studio
-            utils.update_studio_link(movie.filename, studio_current, False)
-            utils.update_studio_link(movie.filename, studio_new, True)
+            plan.studio(movie.filename, studio_current, False)
+            plan.studio(movie.filename, studio_new, True)
+
+        movie.studio = studio
     for k, v in data.dict().items():
         setattr(movie, k, v)
     movie.processed = True if not movie.processed else movie.processed
 
-    utils.rename_movie_file(movie)
-    db.commit()
-    db.refresh(movie)
-    return movie
+    utils.rename_movie_file(movie, plan=plan, db=db)
+    journal.record_plan(db, plan, movie.id)
+
+    # the write queue commits it together with the rest of its batch
+    db.flush()
+    return refresh_movie(db, movie)
 
 
 def delete_movie(
@@ -161,7 +270,11 @@ def delete_movie(
     if movie is None:
         raise InvalidIDException(f"Movie ID {id} does not exist")
 
-    utils.remove_movie(movie)
+    # journaled after the movie's earlier changes, so it is applied after
+    # them
+    plan = LinkPlan()
+    utils.remove_movie(movie, plan)
+    journal.record_plan(db, plan, movie.id)
 
     db.delete(movie)
     db.commit()
@@ -183,15 +296,14 @@ def add_movie_actor(db: Session, movie_id: int, actor_id: int) -> models.Movie:
                 f"Actor ID {actor_id} is already on Movie ID {movie_id}"
             )
     movie.actors.append(actor)
-    db.commit()
 
-    utils.rename_movie_file(movie)
-    try:
-        utils.update_actor_link(movie.filename, actor.name, True)
-    except Exception as e:
-        logger.error(str(e))
-    db.commit()
-    db.refresh(movie)
+    plan = LinkPlan()
+    utils.rename_movie_file(movie, plan=plan, db=db)
+    plan.actor(movie.filename, actor.name, True)
+    journal.record_plan(db, plan, movie.id)
+
+    db.flush()
+    movie = refresh_movie(db, movie)
 
     return movie
 
@@ -211,12 +323,16 @@ def delete_movie_actor(
 
     if actor in movie.actors:
         movie.actors.remove(actor)
+
+        plan = LinkPlan()
+        plan.actor(movie.filename, actor.name, False)
+
         try:
-            utils.update_actor_link(movie.filename, actor.name, False)
+            journal.record_plan(db, plan, movie.id)
         except Exception as e:
             logger.error(str(e))
-        db.commit()
-        db.refresh(movie)
+        db.flush()
+        movie = refresh_movie(db, movie)
 
     return movie
 
@@ -240,14 +356,16 @@ def add_movie_category(
             )
 
     movie.categories.append(category)
-    db.commit()
+
+    plan = LinkPlan()
+    plan.category(movie.filename, category.name, True)
 
     try:
-        utils.update_category_link(movie.filename, category.name, True)
+        journal.record_plan(db, plan, movie.id)
     except Exception as e:
         logger.error(f"update category link error: {str(e)}")
-    db.commit()
-    db.refresh(movie)
+    db.flush()
+    movie = refresh_movie(db, movie)
 
     return movie
 
@@ -268,12 +386,15 @@ def delete_movie_category(
     if category in movie.categories:
         movie.categories.remove(category)
 
+        plan = LinkPlan()
+        plan.category(movie.filename, category.name, False)
+
         try:
-            utils.update_category_link(movie.filename, category.name, False)
+            journal.record_plan(db, plan, movie.id)
         except Exception as e:
             logger.error(f"update category link error: {str(e)}")
 
-    db.commit()
-    db.refresh(movie)
+    db.flush()
+    movie = refresh_movie(db, movie)
 
     return movie
@@ -2,6 +2,7 @@ import logging
 from sqlite3 import IntegrityError
 from typing import List
 
+from sqlalchemy import exc
 from sqlalchemy.orm import Session
 
 from .. import models, utils
@@ -56,24 +57,13 @@ def delete_series(db: Session, series_id: int) -> models.Series:
     return series
 
 
-def update_series(
-    db: Session,
-    id: int,
-    name: str,
-) -> models.Series:
-    series = get_series(db, id)
-
-    if series is None:
-        raise InvalidIDException(f"Series ID {id} does not exist")
-
+def rename_series(db: Session, series: models.Series, name: str) -> None:
+    # flushed only, the caller commits once the links are renamed too
     series.name = name
 
     try:
-        db.commit()
-        db.refresh(series)
-    except IntegrityError:
+        db.flush()
+    except exc.IntegrityError:
         db.rollback()
 
         raise DuplicateEntryException(f"Series {name} already exists")
-
-    return series
@@ -2,7 +2,7 @@ import logging
 from sqlite3 import IntegrityError
 from typing import List
 
-from sqlalchemy import func
+from sqlalchemy import exc, func
 from sqlalchemy.orm import Session
 
 from .. import models, utils
@@ -60,24 +60,13 @@ def delete_studio(db: Session, studio_id: int) -> models.Studio:
     return studio
 
 
-def update_studio(
-    db: Session,
-    id: int,
-    name: str,
-) -> models.Actor:
-    studio = get_studio_by_id(id, db)
-
-    if studio is None:
-        raise InvalidIDException(f"Studio ID {id} does not exist")
-
+def rename_studio(db: Session, studio: models.Studio, name: str) -> None:
+    # flushed only, the caller commits once the links are renamed too
     studio.name = name
 
     try:
-        db.commit()
-        db.refresh(studio)
-    except IntegrityError:
+        db.flush()
+    except exc.IntegrityError:
         db.rollback()
 
         raise DuplicateEntryException(f"Studio {name} already exists")
-
-    return studio
@@ -16,3 +16,15 @@ class PathException(Exception):
 
 class IntegrityConstraintException(Exception):
     pass
+
+
+class ParseException(Exception):
+    pass
+
+
+class RebuildException(Exception):
+    pass
+
+
+class DatabaseBusyException(Exception):
+    pass
@@ -0,0 +1,634 @@
+import errno
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from functools import wraps
+from threading import BoundedSemaphore, Lock
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from .config import get_config
+
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+# every path below is relative to one of these configured directories
+FILESYSTEM_ROOTS = (
+    "imports",
+    "movies",
+    "actors",
+    "categories",
+    "series",
+    "studios",
+)
+
+# the link trees are not part of a checkout, they are made on first use
+CREATED_ROOTS = ("actors", "categories", "series", "studios")
+
+
+# cross-device copies running at once, the I/O budget of all migrations
+copy_slots = BoundedSemaphore(int(config.get("migrate_workers", 2)))
+
+# the progress of a long copy is logged this often
+COPY_PROGRESS_INTERVAL = 5.0
+
+# the roots are compared with their paths at most this often
+ROOT_CHECK_INTERVAL = 5.0
+
+# what an operation on the fd of a deleted or stale root fails with
+STALE_ERRORS = (errno.ENOENT, errno.ESTALE)
+
+
+def error(code: int, name: str) -> OSError:
+    return OSError(code, os.strerror(code), name)
+
+
+def copy_file_data(
+    source: int,
+    target: int,
+    size: int,
+    name: str,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    chunk_size = int(config.get("migrate_chunk_size_mb", 64)) * 1024 * 1024
+    kernel_copy = hasattr(os, "copy_file_range")
+    copied = 0
+    started = reported = time.monotonic()
+
+    while copied < size:
+        count = min(chunk_size, size - copied)
+
+        if kernel_copy:
+            try:
+                sent = os.copy_file_range(source, target, count)
+            except OSError as e:
+                # kernels before 5.3 do not copy across filesystems
+                if e.errno not in (
+                    errno.EXDEV,
+                    errno.EINVAL,
+                    errno.ENOSYS,
+                    errno.EOPNOTSUPP,
+                ):
+                    raise
+
+                kernel_copy = False
+                continue
+        else:
+            sent = os.sendfile(target, source, None, count)
+
+        if sent == 0:
+            # the source shrank, the size check of the caller catches it
+            break
+
+        copied += sent
+        now = time.monotonic()
+
+        if progress is not None:
+            progress(copied, size)
+
+        if now - reported >= COPY_PROGRESS_INTERVAL:
+            reported = now
+            logger.info(
+                "Copying %s: %d of %d MiB (%.0f MiB/s)",
+                name,
+                copied >> 20,
+                size >> 20,
+                (copied >> 20) / (now - started),
+            )
+
+    return copied
+
+
+class Filesystem(ABC):
+    def __init__(self, paths: Dict[str, str]):
+        self.paths = {
+            root: os.path.abspath(path) for root, path in paths.items()
+        }
+
+    def path(self, root: str, name: str = "") -> str:
+        return f"{self.paths[root]}/{name}" if name else self.paths[root]
+
+    @abstractmethod
+    def exists(self, root: str, name: str) -> bool:
+        ...
+
+    @abstractmethod
+    def lexists(self, root: str, name: str) -> bool:
+        ...
+
+    @abstractmethod
+    def rename(self, root: str, name: str, root_new: str, name_new: str):
+        ...
+
+    @abstractmethod
+    def copy(
+        self,
+        root: str,
+        name: str,
+        root_new: str,
+        name_new: str,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> None:
+        ...
+
+    def move(
+        self,
+        root: str,
+        name: str,
+        root_new: str,
+        name_new: str,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> None:
+        try:
+            self.rename(root, name, root_new, name_new)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+        # imports and movies may live on different volumes
+        with copy_slots:
+            self.copy(root, name, root_new, name_new, progress)
+
+        self.remove(root, name)
+
+    @abstractmethod
+    def symlink(self, target: str, root: str, name: str) -> None:
+        ...
+
+    @abstractmethod
+    def readlink(self, root: str, name: str) -> str:
+        ...
+
+    @abstractmethod
+    def remove(self, root: str, name: str) -> None:
+        ...
+
+    @abstractmethod
+    def mkdir(self, root: str, name: str) -> None:
+        ...
+
+    @abstractmethod
+    def rmdir(self, root: str, name: str) -> None:
+        ...
+
+    @abstractmethod
+    def listdir(self, root: str, name: str = "") -> List[str]:
+        ...
+
+    @abstractmethod
+    def list_directories(self, root: str, name: str = "") -> List[str]:
+        ...
+
+    def reopen_if_replaced(self, force: bool = False) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def retry_if_stale(operation: Callable) -> Callable:
+    # the old fd of a root that was deleted fails every operation, the
+    # root is reopened and the operation tried once more
+    @wraps(operation)
+    def retried(self, *args, **kwargs):
+        try:
+            return operation(self, *args, **kwargs)
+        except OSError as e:
+            if e.errno not in STALE_ERRORS or not self.has_stale_root():
+                raise
+
+        self.reopen_if_replaced(force=True)
+        return operation(self, *args, **kwargs)
+
+    return retried
+
+
+class DirectoryFilesystem(Filesystem):
+    # each root is opened once, every operation after that only resolves
+    # the few components below it instead of the whole mount path
+    def __init__(self, paths: Dict[str, str]):
+        super().__init__(paths)
+        self.fds: Dict[str, int] = {}
+        # fds of replaced roots, another thread may still be using one
+        self.retired: List[int] = []
+        self.lock = Lock()
+        self.checked = 0.0
+
+    def open_root(self, root: str) -> int:
+        if root in CREATED_ROOTS:
+            os.makedirs(self.paths[root], exist_ok=True)
+
+        return os.open(
+            self.paths[root], os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC
+        )
+
+    def fd(self, root: str) -> int:
+        fd = self.fds.get(root)
+
+        if fd is None:
+            # opened lazily, the directories may not exist at startup yet
+            with self.lock:
+                fd = self.fds.get(root)
+
+                if fd is None:
+                    fd = self.open_root(root)
+                    self.fds[root] = fd
+
+        return fd
+
+    def exists(self, root: str, name: str) -> bool:
+        try:
+            os.stat(name, dir_fd=self.fd(root))
+        except (OSError, ValueError):
+            return False
+
+        return True
+
+    def lexists(self, root: str, name: str) -> bool:
+        try:
+            os.stat(name, dir_fd=self.fd(root), follow_symlinks=False)
+        except (OSError, ValueError):
+            return False
+
+        return True
+
+    @retry_if_stale
+    def rename(self, root: str, name: str, root_new: str, name_new: str):
+        os.rename(
+            name,
+            name_new,
+            src_dir_fd=self.fd(root),
+            dst_dir_fd=self.fd(root_new),
+        )
+
+    def copy(
+        self,
+        root: str,
+        name: str,
+        root_new: str,
+        name_new: str,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> None:
+        # copied under a temporary name, the file only shows up complete
+        partial = f".{name_new}.partial"
+        source = os.open(
+            name, os.O_RDONLY | os.O_CLOEXEC, dir_fd=self.fd(root)
+        )
+
+        try:
+            stat = os.fstat(source)
+            target = os.open(
+                partial,
+                os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_CLOEXEC,
+                stat.st_mode & 0o7777,
+                dir_fd=self.fd(root_new),
+            )
+
+            try:
+                copied = copy_file_data(
+                    source, target, stat.st_size, name, progress
+                )
+                os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                os.fsync(target)
+
+                if copied != stat.st_size or (
+                    os.fstat(target).st_size != stat.st_size
+                ):
+                    raise OSError(
+                        errno.EIO,
+                        f"Copied {copied} of {stat.st_size} bytes",
+                        name,
+                    )
+            except BaseException:
+                os.close(target)
+                os.remove(partial, dir_fd=self.fd(root_new))
+                raise
+
+            os.close(target)
+        finally:
+            os.close(source)
+
+        os.rename(
+            partial,
+            name_new,
+            src_dir_fd=self.fd(root_new),
+            dst_dir_fd=self.fd(root_new),
+        )
+        os.fsync(self.fd(root_new))
+
+    @retry_if_stale
+    def symlink(self, target: str, root: str, name: str) -> None:
+        os.symlink(target, name, dir_fd=self.fd(root))
+
+    @retry_if_stale
+    def readlink(self, root: str, name: str) -> str:
+        return os.readlink(name, dir_fd=self.fd(root))
+
+    @retry_if_stale
+    def remove(self, root: str, name: str) -> None:
+        os.remove(name, dir_fd=self.fd(root))
+
+    @retry_if_stale
+    def mkdir(self, root: str, name: str) -> None:
+        os.mkdir(name, dir_fd=self.fd(root))
+
+    @retry_if_stale
+    def rmdir(self, root: str, name: str) -> None:
+        os.rmdir(name, dir_fd=self.fd(root))
+
+    @retry_if_stale
+    def scandir(self, root: str, name: str, directories: bool) -> List[str]:
+        fd = os.open(
+            name or ".",
+            os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC,
+            dir_fd=self.fd(root),
+        )
+
+        try:
+            with os.scandir(fd) as entries:
+                return [
+                    entry.name
+                    for entry in entries
+                    if not directories or entry.is_dir(follow_symlinks=False)
+                ]
+        finally:
+            os.close(fd)
+
+    def listdir(self, root: str, name: str = "") -> List[str]:
+        return self.scandir(root, name, False)
+
+    def list_directories(self, root: str, name: str = "") -> List[str]:
+        return self.scandir(root, name, True)
+
+    def has_stale_root(self) -> bool:
+        # only the open fds are checked, no path is resolved
+        for fd in list(self.fds.values()):
+            try:
+                if os.fstat(fd).st_nlink == 0:
+                    return True
+            except OSError:
+                return True
+
+        return False
+
+    def reopen_if_replaced(self, force: bool = False) -> None:
+        # a root that was moved away or recreated would keep its old fd,
+        # the new one is swapped in and the old one stays open until close,
+        # so an operation holding it never sees its number reused
+        now = time.monotonic()
+
+        if not force and now - self.checked < ROOT_CHECK_INTERVAL:
+            return
+
+        with self.lock:
+            self.checked = now
+
+            for root, fd in list(self.fds.items()):
+                try:
+                    opened = os.fstat(fd)
+                    current = os.stat(self.paths[root])
+                except OSError:
+                    opened = current = None
+
+                if current is not None and (
+                    current.st_dev,
+                    current.st_ino,
+                ) == (opened.st_dev, opened.st_ino):
+                    continue
+
+                logger.info("%s was replaced, reopening it", root)
+
+                try:
+                    self.fds[root] = self.open_root(root)
+                except OSError:
+                    # opened again by the next operation that needs it
+                    del self.fds[root]
+
+                self.retired.append(fd)
+
+    def close(self) -> None:
+        with self.lock:
+            for fd in [*self.fds.values(), *self.retired]:
+                os.close(fd)
+
+            self.fds.clear()
+            self.retired.clear()
+
+
+class MemoryLink(NamedTuple):
+    target: str
+
+
+MemoryEntry = Union[Dict, MemoryLink, bytes]
+
+
+class MemoryFilesystem(Filesystem):
+    # a stand-in for benchmarks and tests, directories are dicts, files
+    # are bytes and links keep their target, errors follow the kernel's
+    def __init__(self, paths: Dict[str, str]):
+        super().__init__(paths)
+        self.roots: Dict[str, Dict] = {root: {} for root in paths}
+        self.lock = Lock()
+
+    def parent(self, root: str, name: str) -> Tuple[Dict, str]:
+        directory = self.roots[root]
+        *parts, leaf = name.split("/")
+
+        for part in parts:
+            directory = directory.get(part)
+
+            if not isinstance(directory, dict):
+                raise error(errno.ENOENT, name)
+
+        return (directory, leaf)
+
+    def entry(self, root: str, name: str) -> MemoryEntry:
+        if not name:
+            return self.roots[root]
+
+        directory, leaf = self.parent(root, name)
+
+        if leaf not in directory:
+            raise error(errno.ENOENT, name)
+
+        return directory[leaf]
+
+    def resolve(self, target: str) -> Optional[MemoryEntry]:
+        for root, path in self.paths.items():
+            if target.startswith(f"{path}/"):
+                try:
+                    return self.entry(root, target[len(path) + 1 :])
+                except OSError:
+                    return None
+
+        return None
+
+    def create_file(self, root: str, name: str, data: bytes = b"") -> None:
+        with self.lock:
+            directory, leaf = self.parent(root, name)
+            directory[leaf] = data
+
+    def exists(self, root: str, name: str) -> bool:
+        with self.lock:
+            try:
+                entry = self.entry(root, name)
+            except OSError:
+                return False
+
+            if isinstance(entry, MemoryLink):
+                return self.resolve(entry.target) is not None
+
+            return True
+
+    def lexists(self, root: str, name: str) -> bool:
+        with self.lock:
+            try:
+                self.entry(root, name)
+            except OSError:
+                return False
+
+            return True
+
+    def rename(self, root: str, name: str, root_new: str, name_new: str):
+        with self.lock:
+            directory, leaf = self.parent(root, name)
+
+            if leaf not in directory:
+                raise error(errno.ENOENT, name)
+
+            directory_new, leaf_new = self.parent(root_new, name_new)
+            entry = directory[leaf]
+            replaced = directory_new.get(leaf_new)
+
+            if replaced is entry:
+                return
+
+            if isinstance(entry, dict):
+                if isinstance(replaced, dict) and len(replaced) > 0:
+                    raise error(errno.ENOTEMPTY, name_new)
+                if replaced is not None and not isinstance(replaced, dict):
+                    raise error(errno.ENOTDIR, name_new)
+            elif isinstance(replaced, dict):
+                raise error(errno.EISDIR, name_new)
+
+            del directory[leaf]
+            directory_new[leaf_new] = entry
+
+    def copy(
+        self,
+        root: str,
+        name: str,
+        root_new: str,
+        name_new: str,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> None:
+        with self.lock:
+            entry = self.entry(root, name)
+
+            if not isinstance(entry, bytes):
+                raise error(errno.EISDIR, name)
+
+            directory, leaf = self.parent(root_new, name_new)
+            directory[leaf] = entry
+
+        if progress is not None:
+            progress(len(entry), len(entry))
+
+    def symlink(self, target: str, root: str, name: str) -> None:
+        with self.lock:
+            directory, leaf = self.parent(root, name)
+
+            if leaf in directory:
+                raise error(errno.EEXIST, name)
+
+            directory[leaf] = MemoryLink(target)
+
+    def readlink(self, root: str, name: str) -> str:
+        with self.lock:
+            entry = self.entry(root, name)
+
+            if not isinstance(entry, MemoryLink):
+                raise error(errno.EINVAL, name)
+
+            return entry.target
+
+    def remove(self, root: str, name: str) -> None:
+        with self.lock:
+            directory, leaf = self.parent(root, name)
+
+            if leaf not in directory:
+                raise error(errno.ENOENT, name)
+            if isinstance(directory[leaf], dict):
+                raise error(errno.EISDIR, name)
+
+            del directory[leaf]
+
+    def mkdir(self, root: str, name: str) -> None:
+        with self.lock:
+            directory, leaf = self.parent(root, name)
+
+            if leaf in directory:
+                raise error(errno.EEXIST, name)
+
+            directory[leaf] = {}
+
+    def rmdir(self, root: str, name: str) -> None:
+        with self.lock:
+            directory, leaf = self.parent(root, name)
+
+            if leaf not in directory:
+                raise error(errno.ENOENT, name)
+            if not isinstance(directory[leaf], dict):
+                raise error(errno.ENOTDIR, name)
+            if len(directory[leaf]) > 0:
+                raise error(errno.ENOTEMPTY, name)
+
+            del directory[leaf]
+
+    def listdir(self, root: str, name: str = "") -> List[str]:
+        with self.lock:
+            entry = self.entry(root, name)
+
+            if not isinstance(entry, dict):
+                raise error(errno.ENOTDIR, name)
+
+            return list(entry)
+
+    def list_directories(self, root: str, name: str = "") -> List[str]:
+        with self.lock:
+            entry = self.entry(root, name)
+
+            if not isinstance(entry, dict):
+                raise error(errno.ENOTDIR, name)
+
+            return [
+                child
+                for child, value in entry.items()
+                if isinstance(value, dict)
+            ]
+
+
+filesystem: Optional[Filesystem] = None
+
+
+def get_filesystem() -> Filesystem:
+    global filesystem
+
+    if filesystem is None:
+        filesystem = DirectoryFilesystem(
+            {root: config[root] for root in FILESYSTEM_ROOTS}
+        )
+
+    return filesystem
+
+
+def set_filesystem(replacement: Optional[Filesystem]) -> Optional[Filesystem]:
+    # swaps in another implementation, the previous one is handed back
+    global filesystem
+
+    previous = filesystem
+    filesystem = replacement
+
+    return previous
@@ -0,0 +1,515 @@
+import logging
+import os
+from stat import S_ISREG
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+
+from . import models, utils
+from .exceptions import (
+    DuplicateEntryException,
+    ListFilesException,
+    ParseException,
+)
+
+logger = logging.getLogger(__name__)
+
+# keeps "IN (...)" lists below the SQLite host parameter limit
+CHUNK_SIZE = 500
+
+IMPORT_STATUSES = ("imported", "duplicate", "parse_error", "path_error")
+
+
+def chunks(items: Sequence, size: int = CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def load_name_map(db: Session, model) -> Dict[str, int]:
+    return {
+        name.lower(): id
+        for id, name in db.execute(select(model.id, model.name))
+    }
+
+
+def parse_movie(
+    filename: str,
+    parsed: Tuple[
+        Optional[str],
+        Optional[str],
+        Optional[str],
+        Optional[str],
+        Optional[str],
+    ],
+) -> Tuple[str, Optional[str], Optional[str], Optional[int], List[str]]:
+    name, studio_name, series_name, series_number, actor_names = parsed
+
+    if name is None:
+        raise ParseException(f"Unable to parse a movie name from {filename}")
+
+    return (
+        name,
+        studio_name,
+        series_name,
+        int(series_number) if series_number is not None else None,
+        actor_names.split(", ") if actor_names is not None else [],
+    )
+
+
+def scan_new_files(db: Session, directory: str) -> Dict[str, Tuple]:
+    seen = {
+        state.name: (state.inode, state.size, state.mtime)
+        for state in db.query(models.ImportState)
+    }
+    current = set()
+    scanned = {}
+
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+
+                current.add(entry.name)
+                stat = entry.stat()
+                key = (entry.inode(), stat.st_size, stat.st_mtime_ns)
+
+                if seen.get(entry.name) != key:
+                    scanned[entry.name] = key
+    except OSError:
+        raise ListFilesException(f"Unable to read path {directory}")
+
+    # forget files that left the directory so the table stays small
+    stale = [name for name in seen if name not in current]
+
+    for chunk in chunks(stale):
+        db.execute(
+            delete(models.ImportState).where(
+                models.ImportState.name.in_(chunk)
+            )
+        )
+    db.commit()
+
+    logger.info(
+        "Scanned %s: %d new or changed of %d files",
+        directory,
+        len(scanned),
+        len(current),
+    )
+
+    return dict(sorted(scanned.items()))
+
+
+def stat_files(directory: str, names) -> Dict[str, Tuple]:
+    scanned = {}
+
+    for name in sorted(names):
+        try:
+            stat = os.stat(f"{directory}/{name}")
+        except OSError:
+            continue
+
+        if S_ISREG(stat.st_mode):
+            scanned[name] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    return scanned
+
+
+def store_scanned_files(db: Session, scanned: Dict[str, Tuple]) -> None:
+    rows = [
+        {"name": name, "inode": inode, "size": size, "mtime": mtime}
+        for name, (inode, size, mtime) in scanned.items()
+    ]
+
+    for chunk in chunks(rows):
+        statement = sqlite_insert(models.ImportState)
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[models.ImportState.name],
+                set_={
+                    "inode": statement.excluded.inode,
+                    "size": statement.excluded.size,
+                    "mtime": statement.excluded.mtime,
+                },
+            ),
+            chunk,
+        )
+
+
+def record_scanned_files(db: Session, scanned: Dict[str, Tuple]) -> None:
+    store_scanned_files(db, scanned)
+    db.commit()
+
+
+def drop_recorded_files(
+    db: Session, scanned: Dict[str, Tuple]
+) -> Dict[str, Tuple]:
+    # a file recorded unchanged was seen before, or moved here by the app
+    recorded = {}
+
+    for chunk in chunks(list(scanned)):
+        recorded.update(
+            (state.name, (state.inode, state.size, state.mtime))
+            for state in db.query(models.ImportState).filter(
+                models.ImportState.name.in_(chunk)
+            )
+        )
+
+    return {
+        name: key for name, key in scanned.items() if recorded.get(name) != key
+    }
+
+
+def get_existing_filenames(db: Session, files: Sequence[str]) -> List[str]:
+    existing = []
+
+    for chunk in chunks(files):
+        existing.extend(
+            filename
+            for (filename,) in db.execute(
+                select(models.Movie.filename).where(
+                    models.Movie.filename.in_(chunk)
+                )
+            )
+        )
+
+    return existing
+
+
+def get_movie_ids(db: Session, files: Sequence[str]) -> Dict[str, int]:
+    movie_ids = {}
+
+    for chunk in chunks(files):
+        movie_ids.update(
+            (filename, id)
+            for id, filename in db.execute(
+                select(models.Movie.id, models.Movie.filename).where(
+                    models.Movie.filename.in_(chunk)
+                )
+            )
+        )
+
+    return movie_ids
+
+
+def get_movies(db: Session, movie_ids: Sequence[int]) -> List[models.Movie]:
+    movies = {}
+
+    for chunk in chunks(movie_ids):
+        movies.update(
+            (movie.id, movie)
+            for movie in db.query(models.Movie)
+            .options(
+                selectinload(models.Movie.actors),
+                selectinload(models.Movie.categories),
+                selectinload(models.Movie.series),
+                selectinload(models.Movie.studio),
+            )
+            .filter(models.Movie.id.in_(chunk))
+        )
+
+    return [movies[id] for id in movie_ids]
+
+
+def load_name_maps(
+    db: Session,
+) -> Tuple[Dict[str, int], Dict[str, int], Dict[str, int]]:
+    return (
+        load_name_map(db, models.Studio),
+        load_name_map(db, models.Series),
+        load_name_map(db, models.Actor),
+    )
+
+
+def upsert_names(
+    db: Session, model, names: Dict[str, str], ids: Dict[str, int]
+) -> None:
+    if len(names) == 0:
+        return
+
+    if hasattr(model, "sort_name"):
+        rows = [
+            {"name": name, "sort_name": utils.generate_sort_name(name)}
+            for name in names.values()
+        ]
+    else:
+        rows = [{"name": name} for name in names.values()]
+
+    db.execute(sqlite_insert(model).on_conflict_do_nothing(), rows)
+
+    # sqlite's lower() only folds ascii, the rows are found by the exact
+    # spelling that was inserted
+    keys = {name: key for key, name in names.items()}
+
+    for chunk in chunks(list(keys)):
+        ids.update(
+            (keys[name], id)
+            for id, name in db.execute(
+                select(model.id, model.name).where(model.name.in_(chunk))
+            )
+        )
+
+    unresolved = [name for key, name in names.items() if key not in ids]
+
+    if len(unresolved) > 0:
+        logger.warn(
+            "Unable to create %s %s, their sort names are taken",
+            model.__tablename__,
+            ", ".join(unresolved),
+        )
+
+
+def create_missing_properties(
+    db: Session,
+    parsed_files: Sequence[Tuple],
+    studio_ids: Dict[str, int],
+    series_ids: Dict[str, int],
+    actor_ids: Dict[str, int],
+) -> None:
+    # lowercased name -> first spelling seen, for names not in the db yet
+    studios: Dict[str, str] = {}
+    series: Dict[str, str] = {}
+    actors: Dict[str, str] = {}
+
+    for _, studio_name, series_name, _, actor_names in parsed_files:
+        if studio_name is not None and studio_name.lower() not in studio_ids:
+            studios.setdefault(studio_name.lower(), studio_name)
+
+        if series_name is not None and series_name.lower() not in series_ids:
+            series.setdefault(series_name.lower(), series_name)
+
+        if actor_names is not None:
+            for actor_name in actor_names.split(", "):
+                if actor_name.lower() not in actor_ids:
+                    actors.setdefault(actor_name.lower(), actor_name)
+
+    upsert_names(db, models.Studio, studios, studio_ids)
+    upsert_names(db, models.Series, series, series_ids)
+    upsert_names(db, models.Actor, actors, actor_ids)
+
+    if len(studios) + len(series) + len(actors) == 0:
+        return
+
+    logger.info(
+        "Created %d studios, %d series and %d actors for import",
+        len(studios),
+        len(series),
+        len(actors),
+    )
+
+
+def build_movie_row(
+    filename: str,
+    parsed: Tuple,
+    studio_ids: Dict[str, int],
+    series_ids: Dict[str, int],
+    actor_ids: Dict[str, int],
+) -> Tuple[Dict, List[int]]:
+    (
+        name,
+        studio_name,
+        series_name,
+        series_number,
+        actor_names,
+    ) = parse_movie(filename, parsed)
+
+    row = {
+        "filename": filename,
+        "name": name,
+        "sort_name": utils.generate_sort_name(name),
+        "studio_id": studio_ids.get(studio_name.lower())
+        if studio_name is not None
+        else None,
+        "series_id": series_ids.get(series_name.lower())
+        if series_name is not None
+        else None,
+        "series_number": series_number,
+        "processed": False,
+    }
+    row_actor_ids = list(
+        dict.fromkeys(
+            actor_ids[actor_name.lower()]
+            for actor_name in actor_names
+            if actor_name.lower() in actor_ids
+        )
+    )
+
+    return (row, row_actor_ids)
+
+
+def insert_movie_actors(
+    db: Session,
+    movie_ids: Dict[str, int],
+    movie_actor_ids: Dict[str, List[int]],
+) -> None:
+    actor_rows = [
+        {"movie_id": movie_ids[filename], "actor_id": actor_id}
+        for filename, ids in movie_actor_ids.items()
+        if filename in movie_ids
+        for actor_id in ids
+    ]
+
+    if len(actor_rows) > 0:
+        db.execute(insert(models.movies_actors), actor_rows)
+
+
+def bulk_import(
+    db: Session, files: List[str], create_properties: bool = False
+) -> List[models.Movie]:
+    studio_ids, series_ids, actor_ids = load_name_maps(db)
+    parsed_files = list(zip(*utils.parse_filenames(files)))
+
+    movie_rows = []
+    movie_actor_ids: Dict[str, List[int]] = {}
+
+    if create_properties:
+        create_missing_properties(
+            db, parsed_files, studio_ids, series_ids, actor_ids
+        )
+
+    for filename, parsed in zip(files, parsed_files):
+        row, row_actor_ids = build_movie_row(
+            filename, parsed, studio_ids, series_ids, actor_ids
+        )
+        movie_rows.append(row)
+        movie_actor_ids[filename] = row_actor_ids
+
+    if len(movie_rows) == 0:
+        db.commit()
+        return []
+
+    existing = get_existing_filenames(db, files)
+
+    if len(existing) > 0:
+        raise DuplicateEntryException(
+            f"Movie {existing[0]} already exists in database"
+        )
+
+    try:
+        db.execute(insert(models.Movie.__table__), movie_rows)
+
+        movie_ids = get_movie_ids(db, files)
+        insert_movie_actors(db, movie_ids, movie_actor_ids)
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise DuplicateEntryException(
+            f"Unable to import movies, duplicate entry: {e.orig}"
+        )
+
+    logger.info(
+        "Bulk imported %d movies from %s",
+        len(movie_rows),
+        os.path.abspath(utils.config["imports"]),
+    )
+
+    return get_movies(db, [movie_ids[filename] for filename in files])
+
+
+def import_movies_iter(
+    db: Session,
+    files: List[str],
+    batch_size: int = CHUNK_SIZE,
+    directory: Optional[str] = None,
+    create_properties: bool = False,
+) -> Iterator[Dict]:
+    # one record per file, failures are reported and skipped instead of
+    # aborting the import, the last record summarizes the whole run
+    directory = directory or utils.config["imports"]
+    studio_ids, series_ids, actor_ids = load_name_maps(db)
+    counts = {status: 0 for status in IMPORT_STATUSES}
+    parsed_files = list(zip(*utils.parse_filenames(files)))
+
+    for offset in range(0, len(files), batch_size):
+        batch = files[offset : offset + batch_size]
+        records = {}
+        movie_rows = []
+        movie_actor_ids: Dict[str, List[int]] = {}
+        batch_files = []
+
+        for filename, parsed in zip(
+            batch, parsed_files[offset : offset + batch_size]
+        ):
+            if os.path.isfile(f"{directory}/{filename}"):
+                batch_files.append((filename, parsed))
+            else:
+                records[filename] = ("path_error", "Not a regular file")
+
+        if create_properties:
+            create_missing_properties(
+                db,
+                [parsed for _, parsed in batch_files],
+                studio_ids,
+                series_ids,
+                actor_ids,
+            )
+
+        for filename, parsed in batch_files:
+            try:
+                row, row_actor_ids = build_movie_row(
+                    filename, parsed, studio_ids, series_ids, actor_ids
+                )
+            except ParseException as e:
+                records[filename] = ("parse_error", str(e))
+                continue
+
+            movie_rows.append(row)
+            movie_actor_ids[filename] = row_actor_ids
+
+        candidates = [row["filename"] for row in movie_rows]
+
+        for filename in get_existing_filenames(db, candidates):
+            records[filename] = (
+                "duplicate",
+                f"Movie {filename} already exists in database",
+            )
+
+        movie_rows = [
+            row for row in movie_rows if row["filename"] not in records
+        ]
+
+        if len(movie_rows) > 0:
+            # rows clashing on a unique column are skipped, not raised
+            db.execute(
+                sqlite_insert(models.Movie.__table__).on_conflict_do_nothing(),
+                movie_rows,
+            )
+            movie_ids = get_movie_ids(
+                db, [row["filename"] for row in movie_rows]
+            )
+            insert_movie_actors(db, movie_ids, movie_actor_ids)
+
+            for row in movie_rows:
+                filename = row["filename"]
+
+                if filename in movie_ids:
+                    records[filename] = ("imported", movie_ids[filename])
+                else:
+                    records[filename] = (
+                        "duplicate",
+                        f"Movie {filename} clashes with an existing movie "
+                        f"named {row['name']}",
+                    )
+
+        db.commit()
+
+        for filename in batch:
+            status, detail = records[filename]
+            counts[status] += 1
+
+            record = {"filename": filename, "status": status}
+
+            if status == "imported":
+                record["id"] = detail
+            else:
+                record["message"] = detail
+                logger.info("Skipped import of %s: %s", filename, detail)
+
+            yield record
+
+    logger.info("Imported %d of %d movies", counts["imported"], len(files))
+
+    yield {"status": "summary", "total": len(files), **counts}
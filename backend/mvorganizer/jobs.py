@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from . import importer, models, utils
+from .base_db import SessionLocal, reopen_if_replaced
+from .config import get_config
+from .exceptions import ListFilesException
+
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+# error messages kept per job, the counters still cover every failure
+MAX_JOB_ERRORS = 100
+
+ACTIVE_STATUSES = ("queued", "running")
+
+executor = ThreadPoolExecutor(
+    max_workers=int(config.get("import_workers", 1)),
+    thread_name_prefix="import-job",
+)
+
+submit_lock = Lock()
+
+
+def get_job(db: Session, job_id: int) -> Optional[models.ImportJob]:
+    return (
+        db.query(models.ImportJob)
+        .filter(models.ImportJob.id == job_id)
+        .first()
+    )
+
+
+def submit_import_job(db: Session) -> models.ImportJob:
+    directory = os.path.abspath(config["imports"])
+
+    # a second request for the same directory joins the pending job
+    with submit_lock:
+        job = (
+            db.query(models.ImportJob)
+            .filter(
+                models.ImportJob.directory == directory,
+                models.ImportJob.status.in_(ACTIVE_STATUSES),
+            )
+            .first()
+        )
+
+        if job is not None:
+            logger.info("Import of %s is already job %d", directory, job.id)
+            return job
+
+        job = models.ImportJob(directory=directory, status="queued")
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+
+    executor.submit(run_import_job, job.id)
+    logger.info("Queued import job %d for %s", job.id, directory)
+
+    return job
+
+
+def run_import_job(job_id: int) -> None:
+    reopen_if_replaced()
+    db = SessionLocal()
+
+    try:
+        job = get_job(db, job_id)
+        job.status = "running"
+        job.started_at = datetime.utcnow()
+        job.finished_at = None
+        job.processed = job.imported = job.duplicates = job.failed = 0
+        db.commit()
+
+        errors = []
+
+        try:
+            files = utils.list_files(job.directory)
+        except ListFilesException as e:
+            finish_job(db, job, "failed", [str(e)])
+            return
+
+        job.total = len(files)
+        db.commit()
+
+        for record in importer.import_movies_iter(
+            db, files, directory=job.directory
+        ):
+            status = record["status"]
+
+            if status == "summary":
+                continue
+
+            job.processed += 1
+
+            if status == "imported":
+                job.imported += 1
+            elif status == "duplicate":
+                job.duplicates += 1
+            else:
+                job.failed += 1
+
+            if status != "imported" and len(errors) < MAX_JOB_ERRORS:
+                errors.append(f"{record['filename']}: {record['message']}")
+
+            if job.processed % importer.CHUNK_SIZE == 0:
+                job.errors = json.dumps(errors)
+                db.commit()
+
+        finish_job(db, job, "done", errors)
+    except Exception as e:
+        logger.exception("Import job %d failed", job_id)
+        db.rollback()
+
+        job = get_job(db, job_id)
+
+        if job is not None:
+            finish_job(db, job, "failed", json.loads(job.errors) + [str(e)])
+    finally:
+        db.close()
+
+
+def finish_job(db: Session, job: models.ImportJob, status: str, errors):
+    job.status = status
+    job.finished_at = datetime.utcnow()
+    job.errors = json.dumps(errors[:MAX_JOB_ERRORS])
+    db.commit()
+
+    logger.info(
+        "Import job %d %s: %d imported, %d duplicates, %d failed",
+        job.id,
+        status,
+        job.imported,
+        job.duplicates,
+        job.failed,
+    )
+
+
+def resume_jobs() -> None:
+    db = SessionLocal()
+
+    # jobs interrupted by a restart start over, duplicates are skipped
+    try:
+        jobs = (
+            db.query(models.ImportJob)
+            .filter(models.ImportJob.status.in_(ACTIVE_STATUSES))
+            .order_by(models.ImportJob.id)
+            .all()
+        )
+
+        for job in jobs:
+            job.status = "queued"
+        db.commit()
+
+        for job in jobs:
+            executor.submit(run_import_job, job.id)
+            logger.info("Resumed import job %d", job.id)
+    finally:
+        db.close()
+
+
+def shutdown() -> None:
+    executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,277 @@
+import logging
+from threading import Event, Lock, Thread
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, event, inspect, select, update
+from sqlalchemy.orm import Session
+
+from . import importer, models
+from .base_db import ReadSessionLocal, SessionLocal, engine, reopen_if_replaced
+from .config import get_config
+from .exceptions import PathException
+from .links import LinkPlan, load_plan
+
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+# journal rows loaded and merged per pass
+JOURNAL_BATCH_SIZE = 500
+
+# the worker also looks for work this often, in case a wakeup was missed
+JOURNAL_POLL_INTERVAL = 5.0
+
+# the worker and synchronous callers never apply entries at the same time
+apply_lock = Lock()
+
+wake = Event()
+
+
+def write_behind() -> bool:
+    return bool(config.get("fs_write_behind", False))
+
+
+def record_plan(db: Session, plan: LinkPlan, movie_id: Optional[int]):
+    # without write-behind the disk changes before the commit, as before
+    if not write_behind():
+        plan.apply()
+        record_imported_moves(db, [plan])
+        return
+
+    if len(plan) == 0:
+        return
+
+    db.add(models.FilesystemJournal(movie_id=movie_id, plan=plan.dump()))
+    db.info["fs_journal"] = True
+
+
+def record_imported_moves(db: Session, plans: List[LinkPlan]) -> None:
+    # movies the app moved back into imports, the watcher and incremental
+    # scans must not import them again until they change
+    names = [
+        name_new
+        for plan in plans
+        for _, (root_new, name_new) in plan.moves
+        if root_new == "imports"
+    ]
+
+    if len(names) > 0:
+        importer.store_scanned_files(
+            db,
+            importer.stat_files(plans[0].filesystem.path("imports"), names),
+        )
+
+
+def movie_file_taken(db: Session, movie_id: int, filename: str) -> bool:
+    # the disk lags behind, the file is taken if another movie has it or
+    # the pending moves leave one there, apply_move checks the disk later
+    other = db.scalar(
+        select(models.Movie.id).where(
+            models.Movie.filename == filename, models.Movie.id != movie_id
+        )
+    )
+
+    if other is not None:
+        return True
+
+    taken = False
+    entries = db.scalars(
+        select(models.FilesystemJournal.plan)
+        .where(models.FilesystemJournal.status == "pending")
+        .order_by(models.FilesystemJournal.id)
+    )
+
+    for data in entries:
+        for current, new in load_plan(data).moves:
+            if current == ("movies", filename):
+                taken = False
+            if new == ("movies", filename):
+                taken = True
+
+    return taken
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def notify(db: Session) -> None:
+    if db.info.pop("fs_journal", False):
+        wake.set()
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def forget(db: Session) -> None:
+    db.info.pop("fs_journal", None)
+
+
+def group_entries(
+    entries: List[models.FilesystemJournal],
+) -> List[List[Tuple[models.FilesystemJournal, LinkPlan]]]:
+    # links before and after a directory rename use different names, so
+    # such an entry is never merged with its neighbours
+    groups: List[List[Tuple[models.FilesystemJournal, LinkPlan]]] = []
+    merging = False
+
+    for entry in entries:
+        plan = load_plan(entry.plan, resume=True)
+
+        if merging and not plan.directories:
+            groups[-1].append((entry, plan))
+        else:
+            groups.append([(entry, plan)])
+
+        merging = not plan.directories
+
+    return groups
+
+
+def fail_entry(entry: models.FilesystemJournal, e: PathException) -> None:
+    logger.error("Journal entry %d failed: %s", entry.id, e)
+    entry.status = "failed"
+    entry.error = str(e)
+
+
+def apply_group(group: List[Tuple[models.FilesystemJournal, LinkPlan]]):
+    try:
+        plan = LinkPlan(resume=True)
+
+        for _, entry_plan in group:
+            plan.merge(entry_plan)
+
+        plan.apply()
+        return
+    except PathException as e:
+        if len(group) == 1:
+            fail_entry(group[0][0], e)
+            return
+
+    # one bad entry must not hold back the ones around it
+    logger.warn("Merged journal entries failed, applying them one by one")
+
+    for entry, entry_plan in group:
+        try:
+            entry_plan.apply()
+        except PathException as e:
+            fail_entry(entry, e)
+
+
+def apply_pending(batch_size: int = JOURNAL_BATCH_SIZE) -> int:
+    applied = 0
+
+    with apply_lock:
+        reopen_if_replaced()
+
+        while True:
+            # loaded and detached, the disk work holds no connection, so
+            # writes are not queued behind it
+            with ReadSessionLocal() as db:
+                entries = (
+                    db.query(models.FilesystemJournal)
+                    .filter(models.FilesystemJournal.status == "pending")
+                    .order_by(models.FilesystemJournal.id)
+                    .limit(batch_size)
+                    .all()
+                )
+
+            if len(entries) == 0:
+                break
+
+            groups = group_entries(entries)
+
+            for group in groups:
+                apply_group(group)
+
+            done = [entry.id for entry in entries if entry.status == "pending"]
+
+            with SessionLocal() as db:
+                db.execute(
+                    delete(models.FilesystemJournal).where(
+                        models.FilesystemJournal.id.in_(done)
+                    )
+                )
+
+                for entry in entries:
+                    if entry.status == "failed":
+                        db.execute(
+                            update(models.FilesystemJournal)
+                            .where(models.FilesystemJournal.id == entry.id)
+                            .values(status="failed", error=entry.error)
+                        )
+
+                record_imported_moves(
+                    db,
+                    [
+                        plan
+                        for group in groups
+                        for entry, plan in group
+                        if entry.status == "pending"
+                    ],
+                )
+                db.commit()
+
+            applied += len(done)
+
+    if applied > 0:
+        logger.info("Applied %d journal entries", applied)
+
+    return applied
+
+
+def drain() -> None:
+    # synchronous disk changes have to see every earlier one on disk
+    if write_behind():
+        apply_pending()
+
+
+def replay() -> int:
+    # entries left over from a crash, failed ones get another chance
+    reopen_if_replaced()
+
+    if not inspect(engine).has_table(models.FilesystemJournal.__tablename__):
+        return 0
+
+    db = SessionLocal()
+
+    try:
+        db.execute(
+            update(models.FilesystemJournal)
+            .where(models.FilesystemJournal.status == "failed")
+            .values(status="pending", error=None)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+    return apply_pending()
+
+
+class JournalWorker:
+    def __init__(self, poll_interval: float = JOURNAL_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.stopped = Event()
+        self.thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        self.thread = Thread(target=self.run, name="fs-journal", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        wake.set()
+
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self) -> None:
+        replay()
+
+        while not self.stopped.is_set():
+            wake.wait(self.poll_interval)
+            wake.clear()
+
+            try:
+                apply_pending()
+            except Exception:
+                logger.exception("Applying the filesystem journal failed")
+
+
+def create_worker() -> JournalWorker:
+    return JournalWorker()
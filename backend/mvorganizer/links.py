@@ -0,0 +1,560 @@
+import errno
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import get_config
+from .exceptions import PathException
+from .filesystem import Filesystem, get_filesystem
+
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+LINK_TREES = ("actors", "categories", "series", "studios")
+
+# problem links listed per kind and tree, the counts cover all of them
+MAX_REPORTED_LINKS = 100
+
+LINK_REPAIR_BATCH_SIZE = 1000
+
+
+class Step(NamedTuple):
+    kind: str
+    root: str
+    name: str
+    # where a move went, or the target of a removed or added link
+    other: Tuple[str, str] = ("", "")
+
+
+class LinkPlan:
+    def __init__(
+        self,
+        workers: int = 1,
+        filesystem: Optional[Filesystem] = None,
+        resume: bool = False,
+    ):
+        # (tree, name/filename) -> (selected, filename)
+        self.links: Dict[Tuple[str, str], Tuple[bool, str]] = {}
+        self.moves: List[Tuple[Tuple[str, str], Tuple[str, str]]] = []
+        self.directories: List[Tuple[str, str, str]] = []
+        self.workers = workers
+        self.filesystem = filesystem or get_filesystem()
+        # a plan applied again after a crash finds some moves already done
+        self.resume = resume
+
+    def __len__(self) -> int:
+        return len(self.links) + len(self.moves) + len(self.directories)
+
+    def link(self, tree: str, name: str, filename: str, selected: bool):
+        # the last change of a link wins, a remove and re-add of the same
+        # link collapses into an add that is a no-op for an existing link
+        self.links[(tree, f"{name}/{filename}")] = (selected, filename)
+
+    def actor(self, filename: str, name: str, selected: bool) -> None:
+        self.link("actors", name, filename, selected)
+
+    def category(self, filename: str, name: str, selected: bool) -> None:
+        self.link("categories", name, filename, selected)
+
+    def series(self, filename: str, name: str, selected: bool) -> None:
+        self.link("series", name, filename, selected)
+
+    def studio(self, filename: str, name: str, selected: bool) -> None:
+        self.link("studios", name, filename, selected)
+
+    def move(self, root: str, name: str, root_new: str, name_new: str):
+        self.moves.append(((root, name), (root_new, name_new)))
+
+    def rename_directory(
+        self, tree: str, name_current: str, name_new: str
+    ) -> None:
+        # links of later steps refer to the directory by its new name
+        self.directories.append((tree, name_current, name_new))
+
+    def merge(self, other: "LinkPlan") -> None:
+        # as if other was applied after this plan, a file that is moved
+        # again goes straight to where it ends up and later links win
+        sources = {new: current for current, new in self.moves}
+
+        for current, new in other.moves:
+            if new in sources:
+                raise PathException(
+                    f"Unable to merge the move to {self.describe(*new)}"
+                )
+
+            current = sources.pop(current, current)
+
+            if current != new:
+                sources[new] = current
+
+        self.moves = [(current, new) for new, current in sources.items()]
+        self.directories.extend(other.directories)
+        self.links.update(other.links)
+
+    def dump(self) -> str:
+        return json.dumps(
+            {
+                "moves": [[*current, *new] for current, new in self.moves],
+                "directories": self.directories,
+                "links": [
+                    [tree, name, selected, filename]
+                    for (tree, name), (
+                        selected,
+                        filename,
+                    ) in self.links.items()
+                ],
+            }
+        )
+
+    def apply(self) -> None:
+        applied: List[Step] = []
+        emptied: Set[Tuple[str, str]] = set()
+
+        self.check_moves()
+
+        try:
+            self.run(self.apply_move, self.moves, applied)
+            self.apply_directory_renames(applied)
+            self.run(
+                partial(self.apply_remove, emptied=emptied),
+                self.select_links(False),
+                applied,
+            )
+            self.run(self.apply_add, self.select_links(True), applied)
+        except PathException:
+            self.rollback(applied)
+            raise
+
+        # link directories left empty go away, like the links in them
+        emptied.difference_update(
+            (tree, os.path.dirname(name))
+            for tree, name in self.select_links(True)
+        )
+
+        for tree, name in emptied:
+            try:
+                self.filesystem.rmdir(tree, name)
+            except OSError:
+                pass
+
+    def select_links(self, selected: bool) -> List[Tuple[str, str]]:
+        return [
+            link
+            for link, (link_selected, _) in self.links.items()
+            if link_selected == selected
+        ]
+
+    def describe(self, root: str, name: str) -> str:
+        return self.filesystem.path(root, name)
+
+    def check_moves(self) -> None:
+        # moves may run concurrently, two of them must never share a target
+        targets: Set[Tuple[str, str]] = set()
+
+        for current, new in self.moves:
+            if new in targets:
+                raise PathException(
+                    f"Unable to move {self.describe(*current)} -> "
+                    f"{self.describe(*new)} as another file is moved there "
+                    "as well"
+                )
+
+            targets.add(new)
+
+    def run(
+        self, function: Callable, items: List, applied: List[Step]
+    ) -> None:
+        # the steps of every item that ran are kept for a rollback, even
+        # when another item failed in the meantime
+        errors: List[PathException] = []
+
+        def attempt(item) -> List[Step]:
+            steps: List[Step] = []
+
+            if not errors:
+                try:
+                    function(item, steps)
+                except PathException as e:
+                    errors.append(e)
+
+            return steps
+
+        if self.workers > 1 and len(items) > 1:
+            with ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="link-plan"
+            ) as executor:
+                for steps in executor.map(attempt, items):
+                    applied.extend(steps)
+        else:
+            for item in items:
+                applied.extend(attempt(item))
+
+        if errors:
+            raise errors[0]
+
+    def apply_move(
+        self,
+        move: Tuple[Tuple[str, str], Tuple[str, str]],
+        steps: List[Step],
+    ) -> None:
+        (root, name), (root_new, name_new) = move
+
+        if self.filesystem.exists(root_new, name_new):
+            if self.resume and not self.filesystem.lexists(root, name):
+                return
+
+            raise PathException(
+                f"Unable to move {self.describe(root, name)} -> "
+                f"{self.describe(root_new, name_new)} as it already exists"
+            )
+
+        try:
+            self.filesystem.move(root, name, root_new, name_new)
+        except OSError:
+            raise PathException(
+                f"Unable to move {self.describe(root, name)} -> "
+                f"{self.describe(root_new, name_new)}"
+            )
+
+        steps.append(Step("move", root, name, (root_new, name_new)))
+
+    def apply_directory_renames(self, applied: List[Step]) -> None:
+        for tree, name_current, name_new in self.directories:
+            try:
+                self.filesystem.rename(tree, name_current, tree, name_new)
+            except FileNotFoundError:
+                # nothing was ever linked under the old name
+                continue
+            except OSError as e:
+                if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                    raise PathException(
+                        f"Unable to rename {self.describe(tree, name_current)}"
+                        f" -> {self.describe(tree, name_new)}"
+                    )
+
+                self.merge_directory(tree, name_current, name_new, applied)
+                continue
+
+            applied.append(Step("move", tree, name_current, (tree, name_new)))
+
+    def merge_directory(
+        self,
+        tree: str,
+        name_current: str,
+        name_new: str,
+        applied: List[Step],
+    ) -> None:
+        # the new name is taken, move the links over one at a time
+        try:
+            filenames = self.filesystem.listdir(tree, name_current)
+        except OSError:
+            raise PathException(
+                f"Unable to read path {self.describe(tree, name_current)}"
+            )
+
+        for filename in filenames:
+            link = f"{name_current}/{filename}"
+            link_new = f"{name_new}/{filename}"
+
+            try:
+                # a link both directories have is only dropped, so that a
+                # rollback does not take it away from the new name
+                if self.filesystem.lexists(tree, link_new):
+                    target = self.filesystem.readlink(tree, link)
+                    self.filesystem.remove(tree, link)
+                    applied.append(Step("remove", tree, link, ("", target)))
+                    continue
+
+                self.filesystem.rename(tree, link, tree, link_new)
+            except OSError:
+                raise PathException(
+                    f"Unable to move {self.describe(tree, link)} -> "
+                    f"{self.describe(tree, link_new)}"
+                )
+
+            applied.append(Step("move", tree, link, (tree, link_new)))
+
+        try:
+            self.filesystem.rmdir(tree, name_current)
+        except OSError:
+            raise PathException(
+                f"Unable to remove {self.describe(tree, name_current)}"
+            )
+
+        applied.append(Step("rmdir", tree, name_current))
+
+    def apply_remove(
+        self,
+        link: Tuple[str, str],
+        steps: List[Step],
+        emptied: Set[Tuple[str, str]],
+    ) -> None:
+        tree, name = link
+        target = self.filesystem.path("movies", self.links[link][1])
+
+        try:
+            self.filesystem.remove(tree, name)
+        except FileNotFoundError:
+            return
+        except OSError:
+            raise PathException(
+                f"Unable to delete link {target} -> {self.describe(*link)}"
+            )
+
+        steps.append(Step("remove", tree, name, ("", target)))
+        emptied.add((tree, os.path.dirname(name)))
+
+    def apply_add(self, link: Tuple[str, str], steps: List[Step]) -> None:
+        # directories are only created when a link can not be made without
+        tree, name = link
+        target = self.filesystem.path("movies", self.links[link][1])
+
+        try:
+            self.filesystem.symlink(target, tree, name)
+        except FileExistsError:
+            return
+        except FileNotFoundError:
+            directory = os.path.dirname(name)
+
+            try:
+                self.filesystem.mkdir(tree, directory)
+                steps.append(Step("mkdir", tree, directory))
+            except FileExistsError:
+                pass
+            except OSError:
+                raise PathException(
+                    "Link directory "
+                    f"{self.describe(tree, directory)} could not be created"
+                )
+
+            try:
+                self.filesystem.symlink(target, tree, name)
+            except OSError:
+                raise PathException(
+                    f"Unable to create link {target} -> {self.describe(*link)}"
+                )
+        except OSError:
+            raise PathException(
+                f"Unable to create link {target} -> {self.describe(*link)}"
+            )
+
+        steps.append(Step("link", tree, name, ("", target)))
+
+    def rollback(self, applied: List[Step]) -> None:
+        # directories made for new links go last, concurrent adds may have
+        # linked into them after the mkdir was recorded
+        steps = [step for step in reversed(applied) if step.kind != "mkdir"]
+        steps.extend(
+            step for step in reversed(applied) if step.kind == "mkdir"
+        )
+
+        for step in steps:
+            try:
+                if step.kind == "move":
+                    self.filesystem.move(*step.other, step.root, step.name)
+                elif step.kind == "remove":
+                    self.filesystem.symlink(
+                        step.other[1], step.root, step.name
+                    )
+                elif step.kind == "mkdir":
+                    self.filesystem.rmdir(step.root, step.name)
+                elif step.kind == "rmdir":
+                    self.filesystem.mkdir(step.root, step.name)
+                elif step.kind == "link":
+                    self.filesystem.remove(step.root, step.name)
+            except OSError as e:
+                logger.error(
+                    "Unable to roll back %s of %s: %s",
+                    step.kind,
+                    self.describe(step.root, step.name),
+                    e,
+                )
+
+
+def load_plan(
+    data: str, filesystem: Optional[Filesystem] = None, resume: bool = False
+) -> LinkPlan:
+    plan = LinkPlan(filesystem=filesystem, resume=resume)
+    steps = json.loads(data)
+
+    for root, name, root_new, name_new in steps["moves"]:
+        plan.move(root, name, root_new, name_new)
+
+    for tree, name_current, name_new in steps["directories"]:
+        plan.rename_directory(tree, name_current, name_new)
+
+    for tree, name, selected, filename in steps["links"]:
+        plan.links[(tree, name)] = (selected, filename)
+
+    return plan
+
+
+def scan_link_directory(
+    filesystem: Filesystem, root: str, name: str = ""
+) -> List[str]:
+    try:
+        return filesystem.listdir(root, name)
+    except OSError:
+        return []
+
+
+def load_expected_links(db: Session, tree: str) -> Set[Tuple[str, str]]:
+    if tree == "actors":
+        query = (
+            select(models.Actor.name, models.Movie.filename)
+            .select_from(models.movies_actors)
+            .join(models.Actor)
+            .join(models.Movie)
+        )
+    elif tree == "categories":
+        query = (
+            select(models.Category.name, models.Movie.filename)
+            .select_from(models.movies_categories)
+            .join(models.Category)
+            .join(models.Movie)
+        )
+    elif tree == "series":
+        query = (
+            select(models.Series.name, models.Movie.filename)
+            .select_from(models.Movie)
+            .join(models.Series)
+        )
+    else:
+        query = (
+            select(models.Studio.name, models.Movie.filename)
+            .select_from(models.Movie)
+            .join(models.Studio)
+        )
+
+    return {(name, filename) for name, filename in db.execute(query)}
+
+
+def list_link_names(filesystem: Filesystem, tree: str) -> List[str]:
+    try:
+        return filesystem.list_directories(tree)
+    except OSError:
+        return []
+
+
+def link_issues(links: Set[Tuple[str, str]]) -> Dict:
+    return {
+        "count": len(links),
+        "links": [
+            f"{name}/{filename}"
+            for name, filename in sorted(links)[:MAX_REPORTED_LINKS]
+        ],
+    }
+
+
+def check_links(
+    db: Session,
+    repair: bool = False,
+    workers: Optional[int] = None,
+    batch_size: int = LINK_REPAIR_BATCH_SIZE,
+) -> Dict:
+    started = time.perf_counter()
+    filesystem = get_filesystem()
+    movie_files = set(scan_link_directory(filesystem, "movies"))
+
+    # the name directories of all four trees are listed concurrently
+    directories = [
+        (tree, name)
+        for tree in LINK_TREES
+        for name in list_link_names(filesystem, tree)
+    ]
+    present: Dict[str, Set[Tuple[str, str]]] = {
+        tree: set() for tree in LINK_TREES
+    }
+
+    with ThreadPoolExecutor(
+        max_workers=workers or int(config.get("scan_workers", 8)),
+        thread_name_prefix="link-check",
+    ) as executor:
+        for (tree, name), filenames in zip(
+            directories,
+            executor.map(
+                lambda directory: scan_link_directory(filesystem, *directory),
+                directories,
+            ),
+        ):
+            present[tree].update((name, filename) for filename in filenames)
+
+    trees = []
+    scanned = 0
+    plan: List[Tuple[str, str, str, bool]] = []
+
+    for tree in LINK_TREES:
+        expected = load_expected_links(db, tree)
+        dangling = {
+            link for link in present[tree] if link[1] not in movie_files
+        }
+        missing = expected - present[tree]
+        extra = present[tree] - expected - dangling
+        scanned += len(present[tree])
+
+        trees.append(
+            {
+                "tree": tree,
+                "links": len(present[tree]),
+                "expected": len(expected),
+                "missing": link_issues(missing),
+                "extra": link_issues(extra),
+                "dangling": link_issues(dangling),
+            }
+        )
+
+        # links to files that are gone can not be repaired by adding them
+        plan.extend(
+            (tree, name, filename, True)
+            for name, filename in sorted(missing)
+            if filename in movie_files
+        )
+        plan.extend(
+            (tree, name, filename, False)
+            for name, filename in sorted(extra | dangling)
+        )
+
+    repaired = 0
+    errors = []
+
+    if repair:
+        for i in range(0, len(plan), batch_size):
+            batch = LinkPlan(filesystem=filesystem)
+
+            for tree, name, filename, selected in plan[i : i + batch_size]:
+                batch.link(tree, name, filename, selected)
+
+            try:
+                batch.apply()
+                repaired += len(batch)
+            except PathException as e:
+                logger.error(str(e))
+                errors.append(str(e))
+
+    elapsed = time.perf_counter() - started
+
+    logger.info(
+        "Checked %d links in %.2fs, %d repairable, %d repaired",
+        scanned,
+        elapsed,
+        len(plan),
+        repaired,
+    )
+
+    return {
+        "trees": trees,
+        "repairable": len(plan),
+        "repaired": repaired,
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": scanned / elapsed if elapsed > 0 else 0.0,
+    }
@@ -1,12 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from . import jobs, journal, migrations, watcher, writes
 from .base_db import engine
 from .config import init
 from .models import Base
 from .routes import (
     actors_router,
     categories_router,
+    maintenance_router,
     movies_router,
     series_router,
     studios_router,
@@ -17,6 +19,7 @@ logger, config = init()
 app = FastAPI()
 
 Base.metadata.create_all(bind=engine)
+migrations.migrate(engine)
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,6 +34,58 @@ app.include_router(
 )
 app.include_router(studios_router, prefix="/studios", tags=["studios"])
 app.include_router(series_router, prefix="/series", tags=["series"])
+app.include_router(
+    maintenance_router, prefix="/maintenance", tags=["maintenance"]
+)
+
+
+import_watcher = (
+    watcher.create_watcher() if config.get("watch_imports") else None
+)
+
+journal_worker = journal.create_worker() if journal.write_behind() else None
+
+
+@app.on_event("startup")
+def resume_import_jobs():
+    jobs.resume_jobs()
+
+
+@app.on_event("startup")
+def start_import_watcher():
+    if import_watcher is not None:
+        import_watcher.start()
+
+
+@app.on_event("startup")
+def start_journal_worker():
+    # without write-behind, leftovers of an earlier run are applied here
+    if journal_worker is not None:
+        journal_worker.start()
+    else:
+        journal.replay()
+
+
+@app.on_event("shutdown")
+def stop_import_jobs():
+    jobs.shutdown()
+
+
+@app.on_event("shutdown")
+def stop_import_watcher():
+    if import_watcher is not None:
+        import_watcher.stop()
+
+
+@app.on_event("shutdown")
+def stop_journal_worker():
+    if journal_worker is not None:
+        journal_worker.stop()
+
+
+@app.on_event("shutdown")
+def stop_write_queue():
+    writes.write_queue.stop()
 
 
 @app.get("/")
@@ -0,0 +1,57 @@
+import sys
+
+import click
+
+from . import journal, links
+from .base_db import SessionLocal
+from .config import init
+
+
+@click.group()
+def cli():
+    init()
+
+
+@cli.command("check-links")
+@click.option("--repair", is_flag=True, help="Fix the links that are off")
+@click.option("--workers", type=int, default=None, help="Scan threads")
+@click.option(
+    "--batch-size",
+    type=int,
+    default=links.LINK_REPAIR_BATCH_SIZE,
+    help="Link changes applied per batch",
+)
+def check_links(repair: bool, workers: int, batch_size: int):
+    """Compare the link trees against the database."""
+    journal.drain()
+    db = SessionLocal()
+
+    try:
+        report = links.check_links(db, repair, workers, batch_size)
+    finally:
+        db.close()
+
+    for tree in report["trees"]:
+        click.echo(
+            f"{tree['tree']:>10}: {tree['links']} links, "
+            f"{tree['expected']} expected, "
+            f"{tree['missing']['count']} missing, "
+            f"{tree['extra']['count']} extra, "
+            f"{tree['dangling']['count']} dangling"
+        )
+
+        for kind in ("missing", "extra", "dangling"):
+            for link in tree[kind]["links"]:
+                click.echo(f"{'':>12}{kind} {link}")
+
+    click.echo(
+        f"{report['repairable']} repairable, {report['repaired']} repaired "
+        f"in {report['elapsed']:.2f}s ({report['throughput']:.0f} links/s)"
+    )
+
+    if len(report["errors"]) > 0 or (not repair and report["repairable"] > 0):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,111 @@
+import logging
+from typing import List, NamedTuple
+
+import click
+from sqlalchemy.engine import Connection, Engine
+
+from . import models
+from .base_db import engine
+from .config import init
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    statements: List[str]
+
+
+# append only, a database at version n has every migration up to n
+MIGRATIONS = [
+    Migration(
+        1,
+        "case-insensitive name indexes",
+        [
+            f"create index if not exists ix_{table}_lower_name "
+            f"on {table} (lower(name))"
+            for table in (
+                "actors",
+                "categories",
+                "movies",
+                "series",
+                "studios",
+            )
+        ],
+    ),
+    Migration(
+        2,
+        "movie list order index",
+        [
+            # covers the movie columns of get_all_movies' order by, so only
+            # the studio and series part is left to sort
+            "create index if not exists ix_movies_list_order on movies "
+            "(processed, studio_id, series_id, sort_name, filename)",
+        ],
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def get_version(connection: Connection) -> int:
+    # kept in the sqlite header, so it travels with the file
+    return connection.exec_driver_sql("pragma user_version").scalar()
+
+
+def upgrade(connection: Connection) -> int:
+    with connection.begin():
+        # the write lock up front, the statements and the version commit
+        # together
+        connection.exec_driver_sql("begin immediate")
+        version = get_version(connection)
+        pending = [m for m in MIGRATIONS if m.version > version]
+
+        for migration in pending:
+            logger.info(
+                "Applying migration %d: %s",
+                migration.version,
+                migration.description,
+            )
+
+            for statement in migration.statements:
+                connection.exec_driver_sql(statement)
+
+            connection.exec_driver_sql(
+                f"pragma user_version={migration.version}"
+            )
+
+    return len(pending)
+
+
+def migrate(engine: Engine) -> int:
+    with engine.connect() as connection:
+        return upgrade(connection)
+
+
+@click.group()
+def cli():
+    init()
+
+
+@cli.command("upgrade")
+def upgrade_command():
+    """Apply the migrations the database is missing."""
+    models.Base.metadata.create_all(bind=engine)
+    applied = migrate(engine)
+
+    click.echo(f"Applied {applied} migrations, at version {LATEST_VERSION}")
+
+
+@cli.command("version")
+def version_command():
+    """Show the schema version of the database."""
+    with engine.connect() as connection:
+        version = get_version(connection)
+
+    click.echo(f"Database at version {version}, latest is {LATEST_VERSION}")
+
+
+if __name__ == "__main__":
+    cli()
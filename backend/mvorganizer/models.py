@@ -1,5 +1,17 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Table
-from sqlalchemy.orm import relationship
+from datetime import datetime
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    String,
+    Table,
+    Text,
+    exists,
+)
+from sqlalchemy.orm import column_property, relationship
 
 from .base_db import Base
 
@@ -131,3 +143,59 @@ class Studio(Base):
         order_by="Movie.name",
         passive_deletes="all",
     )
+
+
+class ImportJob(Base):
+    __tablename__ = "import_jobs"
+
+    id = Column(Integer, primary_key=True)
+    directory = Column(String(255), nullable=False)
+    status = Column(String(16), nullable=False, default="queued")
+
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    total = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    imported = Column(Integer, nullable=False, default=0)
+    duplicates = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    errors = Column(Text, nullable=False, default="[]")
+
+    @property
+    def throughput(self) -> float:
+        if self.started_at is None:
+            return 0.0
+
+        elapsed = (
+            (self.finished_at or datetime.utcnow()) - self.started_at
+        ).total_seconds()
+
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+
+class ImportState(Base):
+    __tablename__ = "import_state"
+
+    name = Column(String(255), primary_key=True)
+    inode = Column(Integer, nullable=False)
+    size = Column(Integer, nullable=False)
+    mtime = Column(Integer, nullable=False)
+
+
+class FilesystemJournal(Base):
+    __tablename__ = "fs_journal"
+
+    id = Column(Integer, primary_key=True)
+    movie_id = Column(Integer, nullable=True, index=True)
+    status = Column(String(16), nullable=False, default="pending")
+    plan = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    error = Column(Text, nullable=True)
+
+
+# changes of the movie that are committed but not on disk yet
+Movie.fs_pending = column_property(
+    exists().where(FilesystemJournal.movie_id == Movie.id)
+)
@@ -1,32 +1,494 @@
+import json
+import os
+import sqlite3
 import sys
-from typing import Dict, List
-
-from . import models, utils
-from .base_db import SessionLocal, engine
-from .config import init
-from .crud import (
-    actors_crud,
-    categories_crud,
-    movies_crud,
-    series_crud,
-    studios_crud,
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import click
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    bindparam,
+    func,
+    select,
 )
-from .exceptions import ListFilesException
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
 
+from . import importer, journal, migrations, models, utils
+from .base_db import create_sqlite_engine, engine, sqlite_pragmas
+from .config import get_logger, init
+from .exceptions import ListFilesException, RebuildException
 
-def run():
-    logger, config = init()
+logger = get_logger()
 
-    # create the database tables and get a connection
-    models.Base.metadata.create_all(bind=engine)
-    db = SessionLocal()
-    logger.info("Created sqlite table schemas")
+
+class Library(NamedTuple):
+    movie_files: List[str]
+    movie_name: Dict[str, Optional[str]]
+    movie_series_number: Dict[str, Optional[str]]
+    movie_actors: Dict[str, List[str]]
+    movie_categories: Dict[str, List[str]]
+    movie_series: Dict[str, List[str]]
+    movie_studios: Dict[str, List[str]]
+    actors: List[str]
+    categories: List[str]
+    series: List[str]
+    studios: List[str]
+
+
+# checkpoints of an interrupted rebuild, only lives in the shadow database
+rebuild_state = Table(
+    "rebuild_state",
+    MetaData(),
+    Column("phase", String(16), primary_key=True),
+    # input rows of the phase already committed, batch size independent
+    Column("position", Integer, nullable=False, default=0),
+    Column("rows", Integer, nullable=False, default=0),
+    Column("done", Boolean, nullable=False, default=False),
+    Column("data", Text, nullable=True),
+)
+
+PROPERTY_TABLES = (
+    models.Actor.__table__,
+    models.Category.__table__,
+    models.Series.__table__,
+    models.Studio.__table__,
+)
+
+
+def scan_link_directory(path: str) -> Optional[List[str]]:
+    try:
+        return utils.scan_files(path)
+    except ListFilesException:
+        return None
+
+
+def count_rows(connection: Connection) -> int:
+    return sum(
+        connection.execute(select(func.count()).select_from(table)).scalar()
+        for table in (
+            models.Actor.__table__,
+            models.Category.__table__,
+            models.Series.__table__,
+            models.Studio.__table__,
+            models.Movie.__table__,
+            models.movies_actors,
+            models.movies_categories,
+        )
+    )
+
+
+def has_live_table(connection: Connection, name: str) -> bool:
+    return (
+        connection.exec_driver_sql(
+            "select 1 from live.sqlite_master "
+            "where type = 'table' and name = ?",
+            (name,),
+        ).first()
+        is not None
+    )
+
+
+def copy_filesystem_journal(connection: Connection) -> None:
+    # disk changes a running server queued during the rebuild, the plans
+    # are resumable so one applied again before the swap does no harm,
+    # movie ids are looked up again by filename
+    connection.exec_driver_sql(
+        "insert into main.fs_journal "
+        "(id, movie_id, status, plan, created_at, error) "
+        "select entry.id, movie.id, entry.status, entry.plan, "
+        "entry.created_at, entry.error "
+        "from live.fs_journal as entry "
+        "left join live.movies as live_movie "
+        "on live_movie.id = entry.movie_id "
+        "left join main.movies as movie "
+        "on movie.filename = live_movie.filename"
+    )
+
+
+def copy_import_history(connection: Connection, live_path: str) -> None:
+    # import jobs, scan state and pending disk changes are not derived
+    # from the files, keep them
+    if not os.path.exists(live_path):
+        return
+
+    connection.exec_driver_sql(
+        "attach database ? as live", (os.path.abspath(live_path),)
+    )
+
+    try:
+        with connection.begin():
+            for table in (
+                models.ImportJob.__table__,
+                models.ImportState.__table__,
+            ):
+                if not has_live_table(connection, table.name):
+                    continue
+
+                columns = ", ".join(column.name for column in table.columns)
+                connection.exec_driver_sql(
+                    f"insert into main.{table.name} ({columns}) "
+                    f"select {columns} from live.{table.name}"
+                )
+
+            if has_live_table(connection, "fs_journal"):
+                copy_filesystem_journal(connection)
+    finally:
+        connection.exec_driver_sql("detach database live")
+
+
+def is_wal_database(path: str) -> bool:
+    # header bytes 18 and 19 are 2 once a database is in WAL mode
+    try:
+        with open(path, "rb") as f:
+            return f.read(20)[18:20] == b"\x02\x02"
+    except FileNotFoundError:
+        return False
+
+
+def copy_database(shadow_path: str, live_path: str) -> None:
+    # a renamed file would be read together with the -wal of the old one,
+    # the backup api writes the pages through the live database's own lock
+    shadow = sqlite3.connect(shadow_path)
+    live = sqlite3.connect(
+        live_path, timeout=int(sqlite_pragmas()["busy_timeout"]) / 1000
+    )
+
+    try:
+        shadow.backup(live)
+    finally:
+        live.close()
+        shadow.close()
+
+    remove_database(shadow_path)
+
+
+def swap_database(shadow_path: str, live_path: str) -> None:
+    if is_wal_database(live_path):
+        copy_database(shadow_path, live_path)
+        return
+
+    # synchronous=OFF skipped the fsyncs, flush before the rename
+    fd = os.open(shadow_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    os.replace(shadow_path, live_path)
+
+    fd = os.open(os.path.dirname(os.path.abspath(live_path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def relax_pragmas(connection: Connection) -> Dict[str, str]:
+    # the rebuild recreates everything, so durability is not worth fsyncs,
+    # but a crashed process must leave the checkpointed batches readable
+    pragmas = {
+        name: connection.exec_driver_sql(f"pragma {name}").scalar()
+        for name in ("journal_mode", "synchronous")
+    }
+
+    connection.exec_driver_sql("pragma journal_mode=WAL")
+    connection.exec_driver_sql("pragma synchronous=OFF")
+
+    return pragmas
+
+
+def restore_pragmas(connection: Connection, pragmas: Dict[str, str]) -> None:
+    for name, value in pragmas.items():
+        connection.exec_driver_sql(f"pragma {name}={value}")
+
+
+def bulk_insert(
+    connection: Connection, table: Table, rows: List[Dict], batch_size: int
+) -> int:
+    inserted = 0
+
+    # rows clashing on a unique column are skipped, not fatal
+    for i in range(0, len(rows), batch_size):
+        result = connection.execute(
+            sqlite_insert(table).on_conflict_do_nothing(),
+            rows[i : i + batch_size],
+        )
+        inserted += result.rowcount
+
+    if inserted < len(rows):
+        logger.warn(
+            "Skipped %d duplicate rows in %s",
+            len(rows) - inserted,
+            table.name,
+        )
+
+    return inserted
+
+
+def load_ids(connection: Connection, table: Table, column) -> Dict[str, int]:
+    return {
+        name: id for id, name in connection.execute(select(table.c.id, column))
+    }
+
+
+def build_movie_rows(
+    library: Library, series_ids: Dict[str, int], studio_ids: Dict[str, int]
+) -> List[Dict]:
+    movie_rows = []
+
+    for filename in library.movie_files:
+        name = library.movie_name[filename]
+        series_number = library.movie_series_number[filename]
+        movie_series = library.movie_series[filename]
+        movie_studios = library.movie_studios[filename]
+
+        # if there is more than one series/studio after deduplication
+        # it means something is odd with the link directories
+        # no right answer here, so just pick one
+        movie_rows.append(
+            {
+                "filename": filename,
+                "name": name,
+                "sort_name": utils.generate_sort_name(name or filename),
+                "series_id": series_ids.get(movie_series[0])
+                if len(movie_series) > 0
+                else None,
+                "series_number": int(series_number)
+                if series_number is not None
+                else None,
+                "studio_id": studio_ids.get(movie_studios[0])
+                if len(movie_studios) > 0
+                else None,
+            }
+        )
+
+    return movie_rows
+
+
+def build_associations(
+    library: Library,
+    movie_ids: Dict[str, int],
+    movie_properties: Dict[str, List[str]],
+    property_ids: Dict[str, int],
+    column: str,
+) -> List[Dict]:
+    # deduplicate the properties per movie
+    return [
+        {"movie_id": movie_ids[filename], column: property_ids[name]}
+        for filename in library.movie_files
+        if filename in movie_ids
+        for name in sorted(set(movie_properties[filename]))
+    ]
+
+
+def load_property_ids(connection: Connection) -> Tuple[Dict[str, int], ...]:
+    return tuple(
+        load_ids(connection, table, table.c.name) for table in PROPERTY_TABLES
+    )
+
+
+def warn_skipped_movies(library: Library, movie_ids: Dict[str, int]) -> None:
+    for filename in library.movie_files:
+        if filename not in movie_ids:
+            logger.warn("Skipped movie %s, its sort name is taken", filename)
+
+
+def load_state(connection: Connection, phase: str):
+    return connection.execute(
+        select(rebuild_state).where(rebuild_state.c.phase == phase)
+    ).first()
+
+
+def save_state(connection: Connection, phase: str, **values) -> None:
+    connection.execute(
+        sqlite_insert(rebuild_state)
+        .values(phase=phase, **values)
+        .on_conflict_do_update(index_elements=["phase"], set_=values)
+    )
+
+
+def checkpoint_library(
+    connection: Connection, phase: str, build: Callable[[], Library]
+) -> Library:
+    state = load_state(connection, phase)
+
+    if state is not None and state.done:
+        logger.info("Resuming after the %s phase", phase)
+        return Library(**json.loads(state.data))
+
+    library = build()
+
+    with connection.begin():
+        save_state(
+            connection, phase, done=True, data=json.dumps(library._asdict())
+        )
+
+    return library
+
+
+def insert_phase(
+    connection: Connection,
+    phase: str,
+    table_rows: List[Tuple[Table, List[Dict]]],
+    batch_size: int,
+) -> int:
+    state = load_state(connection, phase)
+
+    if state is not None and state.done:
+        logger.info("Resuming after the %s phase", phase)
+        return state.rows
+
+    total = sum(len(rows) for _, rows in table_rows)
+    position = state.position if state is not None else 0
+    inserted = state.rows if state is not None else 0
+    skipped: Dict[str, int] = {}
+
+    if position > 0:
+        logger.info(
+            "Resuming the %s phase at row %d of %d", phase, position, total
+        )
+
+    # each batch commits together with its checkpoint
+    start = 0
+
+    for table, rows in table_rows:
+        for i in range(max(position - start, 0), len(rows), batch_size):
+            batch = rows[i : i + batch_size]
+
+            with connection.begin():
+                result = connection.execute(
+                    sqlite_insert(table).on_conflict_do_nothing(), batch
+                )
+                inserted += result.rowcount
+                save_state(
+                    connection,
+                    phase,
+                    position=start + i + len(batch),
+                    rows=inserted,
+                )
+
+            # rows clashing on a unique column are skipped, not fatal
+            if result.rowcount < len(batch):
+                skipped[table.name] = (
+                    skipped.get(table.name, 0) + len(batch) - result.rowcount
+                )
+
+        start += len(rows)
+
+    for name, count in skipped.items():
+        logger.warn("Skipped %d duplicate rows in %s", count, name)
+
+    with connection.begin():
+        save_state(connection, phase, position=total, rows=inserted, done=True)
+
+    return inserted
+
+
+def insert_library(
+    connection: Connection, library: Library, batch_size: int
+) -> int:
+    (
+        actors_table,
+        categories_table,
+        series_table,
+        studios_table,
+    ) = PROPERTY_TABLES
+    movies_table = models.Movie.__table__
+
+    rows = insert_phase(
+        connection,
+        "properties",
+        [
+            (actors_table, [{"name": name} for name in library.actors]),
+            (
+                categories_table,
+                [{"name": name} for name in library.categories],
+            ),
+            (
+                series_table,
+                [
+                    {"name": name, "sort_name": utils.generate_sort_name(name)}
+                    for name in library.series
+                ],
+            ),
+            (
+                studios_table,
+                [
+                    {"name": name, "sort_name": utils.generate_sort_name(name)}
+                    for name in library.studios
+                ],
+            ),
+        ],
+        batch_size,
+    )
+    logger.info("Imported movie properties into database")
+
+    # generate an association of names to DB ids
+    actor_ids, category_ids, series_ids, studio_ids = load_property_ids(
+        connection
+    )
+
+    movie_rows = build_movie_rows(library, series_ids, studio_ids)
+
+    for row in movie_rows:
+        row["processed"] = True
+
+    rows += insert_phase(
+        connection, "movies", [(movies_table, movie_rows)], batch_size
+    )
+    logger.info("Imported movies into database")
+
+    movie_ids = load_ids(connection, movies_table, movies_table.c.filename)
+    warn_skipped_movies(library, movie_ids)
+
+    rows += insert_phase(
+        connection,
+        "associations",
+        [
+            (
+                models.movies_actors,
+                build_associations(
+                    library,
+                    movie_ids,
+                    library.movie_actors,
+                    actor_ids,
+                    "actor_id",
+                ),
+            ),
+            (
+                models.movies_categories,
+                build_associations(
+                    library,
+                    movie_ids,
+                    library.movie_categories,
+                    category_ids,
+                    "category_id",
+                ),
+            ),
+        ],
+        batch_size,
+    )
+    logger.info("Imported movie associations into database")
+
+    return rows
+
+
+def scan_library(config: Dict, workers: Optional[int] = None) -> Library:
     # list the movie files
     try:
         movie_files = utils.list_files(config["movies"])
     except ListFilesException as e:
-        logger.critical(str(e))
-        sys.exit(1)
+        raise RebuildException(str(e))
 
     # create lists of movie properties
     # seed them with the files in the link directories
@@ -39,7 +501,7 @@ def run():
         files: List[str] = locals()[path]
 
         try:
-            files.extend(utils.list_files(config[path]))
+            files.extend(utils.scan_files(config[path]))
             logger.info("Loaded %s from link directory %s", path, config[path])
         except ListFilesException:
             logger.warn(
@@ -51,67 +513,118 @@ def run():
     movie_series = {filename: [] for filename in movie_files}
     movie_studios = {filename: [] for filename in movie_files}
 
+    # link directories are scanned concurrently, listing is i/o bound
+    executor = ThreadPoolExecutor(
+        max_workers=workers or int(config.get("scan_workers", 8)),
+        thread_name_prefix="link-scan",
+    )
+
     for path in ("actors", "categories", "series", "studios"):
         names: List[str] = locals()[path]
+        properties: Dict[str, List[str]] = locals()[f"movie_{path}"]
+        scan_started = time.perf_counter()
 
-        for name in names:
-            try:
-                full_path = f"{config[path]}/{name}"
-                files = utils.list_files(full_path)
-                logger.info("Loaded link files from %s", full_path)
-            except ListFilesException:
-                logger.error("Unable to read link files in %s", full_path)
+        for name, files in zip(
+            names,
+            executor.map(
+                scan_link_directory,
+                (f"{config[path]}/{name}" for name in names),
+            ),
+        ):
+            if files is None:
+                logger.error(
+                    "Unable to read link files in %s/%s", config[path], name
+                )
                 continue
 
-            properties: Dict[str, List[str]] = locals()[f"movie_{path}"]
-
             for file in files:
                 # if this test is false, it means there is a broken link
                 # a link directory file is pointing at a non-existent movie file
                 if file in properties:
                     properties[file].append(name)
-                    logger.info(
+                    logger.debug(
                         "Associated movie %s with %s in %s", file, name, path
                     )
 
-    # get the remaining movie data from the movie files
+        logger.info(
+            "Scanned %d %s link directories in %.2fs",
+            len(names),
+            path,
+            time.perf_counter() - scan_started,
+        )
+
+    executor.shutdown()
+
     movie_name = {filename: None for filename in movie_files}
     movie_series_number = {filename: None for filename in movie_files}
 
-    for file in movie_files:
-        (
-            name,
-            studio_name,
-            series_name,
-            series_number,
-            actor_names,
-        ) = utils.parse_filename(file)
+    return Library(
+        movie_files,
+        movie_name,
+        movie_series_number,
+        movie_actors,
+        movie_categories,
+        movie_series,
+        movie_studios,
+        actors,
+        categories,
+        series,
+        studios,
+    )
+
+
+def parse_library(library: Library, workers: Optional[int] = None) -> Library:
+    (
+        movie_files,
+        movie_name,
+        movie_series_number,
+        movie_actors,
+        movie_categories,
+        movie_series,
+        movie_studios,
+        actors,
+        categories,
+        series,
+        studios,
+    ) = library
+
+    # get the remaining movie data from the movie files
+    parsed = utils.parse_filenames(movie_files, workers)
+
+    for (
+        file,
+        name,
+        studio_name,
+        series_name,
+        series_number,
+        actor_names,
+    ) in zip(movie_files, *parsed):
 
         if name is not None:
             movie_name[file] = name
-            logger.info("Parsed name %s from file %s", name, file)
+            logger.debug("Parsed name %s from file %s", name, file)
 
         if actor_names is not None:
             file_actors = actor_names.split(", ")
 
             actors.extend(file_actors)
             movie_actors[file].extend(file_actors)
-            logger.info("Parsed actors (%s) from file %s", actor_names, file)
+            logger.debug("Parsed actors (%s) from file %s", actor_names, file)
 
         if series_name is not None:
             series.append(series_name)
             movie_series[file].append(series_name)
-            logger.info("Parsed series %s from file %s", series_name, file)
+            logger.debug("Parsed series %s from file %s", series_name, file)
         if series_number is not None:
             movie_series_number[file] = series_number
-            logger.info(
+            logger.debug(
                 "Parsed series number %s from file %s", series_number, file
             )
 
         if studio_name is not None:
             studios.append(studio_name)
             movie_studios[file].append(studio_name)
-            logger.info("Parsed studio %s from file %s", studio_name, file)
+            logger.debug("Parsed studio %s from file %s", studio_name, file)
 
     # deduplicate and alphabetize the movie properties
     actors = sorted(set(actors))
@@ -119,81 +632,440 @@ def run():
     series = sorted(set(series))
     studios = sorted(set(studios))
 
-    # create database entries for the movie properties
-    # generate an association of names to DB entries
-    actor_by_name = {
-        actor.name: actor
-        for actor in [actors_crud.add_actor(db, actor) for actor in actors]
-    }
-    logger.info("Imported actors into database")
-    category_by_name = {
-        category.name: category
-        for category in [
-            categories_crud.add_category(db, category)
-            for category in categories
-        ]
-    }
-    logger.info("Imported categories into database")
-    series_by_name = {
-        series.name: series
-        for series in [series_crud.add_series(db, series) for series in series]
+    return Library(
+        movie_files,
+        movie_name,
+        movie_series_number,
+        movie_actors,
+        movie_categories,
+        movie_series,
+        movie_studios,
+        actors,
+        categories,
+        series,
+        studios,
+    )
+
+
+def shadow_database_path(live_path: str) -> str:
+    # fixed name next to the live database so --resume can find it
+    directory, name = os.path.split(os.path.abspath(live_path))
+    return os.path.join(directory, f".{name}.rebuild")
+
+
+def remove_database(path: str) -> None:
+    for suffix in ("", "-journal", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def rebuild(
+    engine: Engine,
+    config: Dict,
+    workers: Optional[int],
+    batch_size: int,
+) -> int:
+    with engine.connect() as connection:
+        pragmas = relax_pragmas(connection)
+
+        try:
+            models.Base.metadata.create_all(bind=connection)
+            rebuild_state.create(bind=connection, checkfirst=True)
+            logger.info("Created sqlite table schemas")
+
+            library = checkpoint_library(
+                connection, "scan", lambda: scan_library(config, workers)
+            )
+            library = checkpoint_library(
+                connection, "parse", lambda: parse_library(library, workers)
+            )
+
+            rows = insert_library(connection, library, batch_size)
+        finally:
+            restore_pragmas(connection, pragmas)
+
+        # every inserted row must have landed before the swap
+        counted = count_rows(connection)
+
+        if counted != rows:
+            raise RebuildException(
+                f"Rebuilt database has {counted} rows, expected {rows}"
+            )
+
+        # indexes are built once the rows are in, not during the inserts
+        migrations.upgrade(connection)
+
+        # the swapped in file must not depend on a -wal file
+        connection.exec_driver_sql("pragma journal_mode=DELETE")
+        rebuild_state.drop(bind=connection)
+
+        copy_import_history(connection, config["sqlite_db"])
+
+    logger.info("Rebuilt %d movies (%d rows)", len(library.movie_files), rows)
+
+    return rows
+
+
+def rebuild_database(
+    config: Dict, workers: Optional[int], batch_size: int, resume: bool
+) -> int:
+    # build into a shadow file next to the live database, then swap it in
+    live_path = config["sqlite_db"]
+    shadow_path = shadow_database_path(live_path)
+
+    if not resume:
+        remove_database(shadow_path)
+    elif not os.path.exists(shadow_path):
+        logger.info("No interrupted rebuild to resume, starting over")
+
+    engine = create_sqlite_engine(shadow_path)
+
+    try:
+        rows = rebuild(engine, config, workers, batch_size)
+    except RebuildException:
+        engine.dispose()
+        remove_database(shadow_path)
+        raise
+    except BaseException:
+        engine.dispose()
+        logger.error(
+            "Rebuild interrupted, run again with --resume to continue it"
+        )
+        raise
+
+    engine.dispose()
+    swap_database(shadow_path, live_path)
+    logger.info("Swapped rebuilt database into %s", live_path)
+
+    return rows
+
+
+def bulk_update(
+    connection: Connection, table: Table, rows: List[Dict], batch_size: int
+) -> int:
+    if len(rows) == 0:
+        return 0
+
+    columns = [column for column in rows[0] if column != "id"]
+    statement = (
+        table.update()
+        .where(table.c.id == bindparam("_id"))
+        .values({column: bindparam(column) for column in columns})
+    )
+
+    for i in range(0, len(rows), batch_size):
+        connection.execute(
+            statement,
+            [
+                {
+                    "_id": row["id"],
+                    **{column: row[column] for column in columns},
+                }
+                for row in rows[i : i + batch_size]
+            ],
+        )
+
+    return len(rows)
+
+
+def bulk_delete(
+    connection: Connection, table: Table, column, values: List, batch_size: int
+) -> int:
+    # keep each in() list below the sqlite variable limit
+    size = min(batch_size, importer.CHUNK_SIZE)
+
+    for i in range(0, len(values), size):
+        connection.execute(
+            table.delete().where(column.in_(values[i : i + size]))
+        )
+
+    return len(values)
+
+
+def reconcile_associations(
+    connection: Connection,
+    table: Table,
+    column: str,
+    associations: List[Dict],
+    batch_size: int,
+) -> Tuple[int, int]:
+    current = {
+        tuple(row)
+        for row in connection.execute(
+            select(table.c.movie_id, table.c[column])
+        )
     }
-    logger.info("Imported series into database")
-    studio_by_name = {
-        studio.name: studio
-        for studio in [
-            studios_crud.add_studio(db, studio) for studio in studios
+    wanted = {(row["movie_id"], row[column]) for row in associations}
+
+    added = [
+        {"movie_id": movie_id, column: property_id}
+        for movie_id, property_id in sorted(wanted - current)
+    ]
+    removed = sorted(current - wanted)
+
+    statement = table.delete().where(
+        table.c.movie_id == bindparam("_movie_id"),
+        table.c[column] == bindparam("_property_id"),
+    )
+
+    for i in range(0, len(removed), batch_size):
+        connection.execute(
+            statement,
+            [
+                {"_movie_id": movie_id, "_property_id": property_id}
+                for movie_id, property_id in removed[i : i + batch_size]
+            ],
+        )
+
+    bulk_insert(connection, table, added, batch_size)
+
+    return (len(added), len(removed))
+
+
+def reconcile_library(
+    connection: Connection, library: Library, batch_size: int
+) -> int:
+    movies_table = models.Movie.__table__
+    wanted_names = (
+        library.actors,
+        library.categories,
+        library.series,
+        library.studios,
+    )
+
+    # new properties first, movies may point at them
+    rows = 0
+
+    for table, names, ids in zip(
+        PROPERTY_TABLES, wanted_names, load_property_ids(connection)
+    ):
+        added = [
+            {"name": name}
+            if "sort_name" not in table.c
+            else {"name": name, "sort_name": utils.generate_sort_name(name)}
+            for name in names
+            if name not in ids
         ]
+        rows += bulk_insert(connection, table, added, batch_size)
+
+        if len(added) > 0:
+            logger.info("Adding %d %s", len(added), table.name)
+
+    actor_ids, category_ids, series_ids, studio_ids = load_property_ids(
+        connection
+    )
+
+    # diff the movies against the scanned files
+    current = {
+        row.filename: row
+        for row in connection.execute(
+            select(
+                movies_table.c.id,
+                movies_table.c.filename,
+                movies_table.c.name,
+                movies_table.c.sort_name,
+                movies_table.c.series_id,
+                movies_table.c.series_number,
+                movies_table.c.studio_id,
+            )
+        )
     }
-    logger.info("Imported studios into database")
-
-    # add the movies files to the database with their property associations
-    for filename in movie_files:
-        print(filename)
-        name = movie_name[filename]
-        series_number = movie_series_number[filename]
-        series_id = None
-        studio_id = None
-        actors_list = None
-        categories_list = None
 
-        # if there is more than one series/studio after deduplication
-        # it means something is odd with the link directories
-        # no right answer here, so just pick one
-        if len(movie_series[filename]) > 0:
-            series_name = list(set(movie_series[filename]))[0]
-            series_id = series_by_name[series_name].id
-
-        if len(movie_studios[filename]) > 0:
-            studio_name = list(set(movie_studios[filename]))[0]
-            studio_id = studio_by_name[studio_name].id
-
-        # deduplicate actors and categories
-        # create a list of DB objects for the movie associations
-        movie_actors_set = set(movie_actors[filename])
-        actors_list = [
-            actor_by_name[actor_name] for actor_name in movie_actors_set
-        ]
+    added = []
+    changed = []
 
-        movie_categories_set = set(movie_categories[filename])
-        categories_list = [
-            category_by_name[category_name]
-            for category_name in movie_categories_set
-        ]
+    for row in build_movie_rows(library, series_ids, studio_ids):
+        existing = current.pop(row["filename"], None)
+
+        if existing is None:
+            row["processed"] = True
+            added.append(row)
+        elif any(
+            existing._mapping[column] != value for column, value in row.items()
+        ):
+            changed.append({"id": existing.id, **row})
+
+    # whatever is left no longer has a file
+    removed = [row.id for row in current.values()]
+
+    for table in (models.movies_actors, models.movies_categories):
+        bulk_delete(connection, table, table.c.movie_id, removed, batch_size)
+
+    rows += bulk_delete(
+        connection, movies_table, movies_table.c.id, removed, batch_size
+    )
+    rows += bulk_update(connection, movies_table, changed, batch_size)
+    rows += bulk_insert(connection, movies_table, added, batch_size)
+
+    logger.info(
+        "Movies: %d added, %d removed, %d changed",
+        len(added),
+        len(removed),
+        len(changed),
+    )
+
+    movie_ids = load_ids(connection, movies_table, movies_table.c.filename)
+    warn_skipped_movies(library, movie_ids)
+
+    for table, movie_properties, ids, column in (
+        (models.movies_actors, library.movie_actors, actor_ids, "actor_id"),
+        (
+            models.movies_categories,
+            library.movie_categories,
+            category_ids,
+            "category_id",
+        ),
+    ):
+        associations_added, associations_removed = reconcile_associations(
+            connection,
+            table,
+            column,
+            build_associations(
+                library, movie_ids, movie_properties, ids, column
+            ),
+            batch_size,
+        )
+        rows += associations_added + associations_removed
+
+        logger.info(
+            "Associations in %s: %d added, %d removed",
+            table.name,
+            associations_added,
+            associations_removed,
+        )
+
+    # properties that are neither linked nor in a filename are orphans
+    for table, names, ids in zip(
+        PROPERTY_TABLES,
+        wanted_names,
+        (actor_ids, category_ids, series_ids, studio_ids),
+    ):
+        wanted = set(names)
+        orphaned = [id for name, id in ids.items() if name not in wanted]
+        rows += bulk_delete(
+            connection, table, table.c.id, orphaned, batch_size
+        )
+
+        if len(orphaned) > 0:
+            logger.info("Removed %d orphaned %s", len(orphaned), table.name)
+
+    return rows
+
+
+def reconcile_database(
+    config: Dict, workers: Optional[int], batch_size: int, dry_run: bool
+) -> int:
+    library = parse_library(scan_library(config, workers), workers)
+
+    models.Base.metadata.create_all(bind=engine)
+    migrations.migrate(engine)
+
+    # apply only the difference to the live database in one transaction
+    try:
+        with engine.connect() as connection:
+            transaction = connection.begin()
+
+            try:
+                rows = reconcile_library(connection, library, batch_size)
+            finally:
+                # a dry run reports the diff and throws it away
+                if dry_run:
+                    transaction.rollback()
+                else:
+                    transaction.commit()
+    except IntegrityError as e:
+        raise RebuildException(
+            f"Unable to reconcile the database, run a full rebuild: {e.orig}"
+        )
+
+    logger.info(
+        "Reconciled %d movies (%d rows %s)",
+        len(library.movie_files),
+        rows,
+        "would change" if dry_run else "changed",
+    )
+
+    return rows
+
+
+def report_library(library: Library) -> None:
+    logger.info(
+        "Would rebuild %d movies, %d actors, %d categories, %d series, "
+        "%d studios, %d actor and %d category associations",
+        len(library.movie_files),
+        len(library.actors),
+        len(library.categories),
+        len(library.series),
+        len(library.studios),
+        sum(len(set(names)) for names in library.movie_actors.values()),
+        sum(len(set(names)) for names in library.movie_categories.values()),
+    )
+
+
+@click.command()
+@click.option(
+    "--workers",
+    type=int,
+    default=None,
+    help="Link scan threads and filename parsing processes",
+)
+@click.option(
+    "--batch-size",
+    type=int,
+    default=None,
+    help="Rows per insert statement and checkpoint",
+)
+@click.option(
+    "--reconcile",
+    is_flag=True,
+    help="Apply only the difference to the live database",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Scan and report without writing"
+)
+@click.option("--resume", is_flag=True, help="Continue an interrupted rebuild")
+def run(
+    workers: Optional[int],
+    batch_size: Optional[int],
+    reconcile: bool,
+    dry_run: bool,
+    resume: bool,
+):
+    """Rebuild the database from the movie files and link directories."""
+    if resume and (reconcile or dry_run):
+        raise click.UsageError(
+            "--resume only applies to a full rebuild that is not a dry run"
+        )
+
+    logger, config = init()
+    started = time.perf_counter()
+    batch_size = batch_size or int(config.get("rebuild_batch_size", 10000))
+
+    # edits still queued for the disk would be lost to the scan
+    if not dry_run:
+        journal.replay()
+
+    try:
+        if reconcile:
+            rows = reconcile_database(config, workers, batch_size, dry_run)
+        elif dry_run:
+            report_library(
+                parse_library(scan_library(config, workers), workers)
+            )
+            return
+        else:
+            rows = rebuild_database(config, workers, batch_size, resume)
+    except RebuildException as e:
+        logger.critical(str(e))
+        sys.exit(1)
 
-        # add the movie to the database
-        movies_crud.add_movie(
-            db,
-            filename,
-            name,
-            studio_id,
-            series_id,
-            series_number,
-            actors_list,
-            categories_list,
-            True,
-        )
-        logger.info("Imported movie %s into database", filename)
+    elapsed = time.perf_counter() - started
+    logger.info(
+        "%s database in %.2fs, %.0f rows/s",
+        "Reconciled" if reconcile else "Rebuilt",
+        elapsed,
+        rows / elapsed if elapsed > 0 else 0,
+    )
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 from .actors import router as actors_router
 from .categories import router as categories_router
+from .maintenance import router as maintenance_router
 from .movies import router as movies_router
 from .series import router as series_router
 from .studios import router as studios_router
@@ -6,17 +6,18 @@ from fastapi.exceptions import HTTPException
 from .. import schemas
 from ..base_db import Session
 from ..config import get_logger
-from ..crud import actors_crud
+from ..crud import actors_crud, movies_crud
 from ..exceptions import (
     DuplicateEntryException,
     IntegrityConstraintException,
     InvalidIDException,
     PathException,
 )
-from ..session import get_db
-from ..utils import rename_movie_file
+from ..session import get_db, get_read_db
+from ..utils import rename_link_directory
 
 logger = get_logger()
+
 router = APIRouter()
 
 
@@ -45,12 +46,12 @@ def add_actor(
 
 
 @router.get("", response_model=List[schemas.Actor])
-def get_actors(db: Session = Depends(get_db)):
+def get_actors(db: Session = Depends(get_read_db)):
     return actors_crud.get_all_actors(db)
 
 
 @router.get("/{actor_id}")
-def get_actor(actor_id: int, db: Session = Depends(get_db)):
+def get_actor(actor_id: int, db: Session = Depends(get_read_db)):
     actor = actors_crud.get_actor_by_id(actor_id, db)
     if actor is None:
         raise HTTPException(
@@ -61,7 +62,7 @@ def get_actor(actor_id: int, db: Session = Depends(get_db)):
 
 
 @router.get("/{name}/name")
-def get_actor_by_name(name: str, db: Session = Depends(get_db)):
+def get_actor_by_name(name: str, db: Session = Depends(get_read_db)):
     actor = actors_crud.get_actor_by_name(name, db)
     if actor is None:
         raise HTTPException(
@@ -90,16 +91,40 @@ def get_actor_by_name(name: str, db: Session = Depends(get_db)):
     },
 )
 def update_actor(
-    id: int, data: schemas.MoviePropertySchema, db: Session = Depends(get_db)
+    id: int,
+    data: schemas.MoviePropertySchema,
+    merge: bool = False,
+    db: Session = Depends(get_db),
 ):
     try:
         actor = actors_crud.get_actor_by_id(db, id)
-        actor_name = actor.name
 
-        actor = actors_crud.update_actor(db, id, data.name.strip())
+        if actor is None:
+            raise InvalidIDException(f"Actor ID {id} does not exist")
 
-        for movie in actor.movies:
-            rename_movie_file(movie, actor_current=actor_name)
+        actor_name = actor.name
+        name = data.name.strip()
+        movie_ids = actors_crud.get_actor_movie_ids(db, id)
+
+        # renaming to the name of another actor merges the two with merge
+        target = actors_crud.get_actor_by_name(name, db)
+
+        if target is not None and target.id != actor.id:
+            if not merge:
+                raise DuplicateEntryException(f"Actor {name} already exists")
+
+            actors_crud.merge_actor(db, actor, target)
+            actor = target
+        else:
+            actors_crud.rename_actor(db, actor, name)
+
+        rename_link_directory(
+            db,
+            "actors",
+            actor_name,
+            actor.name,
+            movies_crud.get_movies_by_ids(db, movie_ids),
+        )
         db.commit()
 
     except DuplicateEntryException as e:
@@ -13,8 +13,8 @@ from ..exceptions import (
     InvalidIDException,
     PathException,
 )
-from ..session import get_db
-from ..utils import rename_movie_file
+from ..session import get_db, get_read_db
+from ..utils import rename_link_directory
 
 logger = get_logger()
 
@@ -22,12 +22,12 @@ router = APIRouter()
 
 
 @router.get("", response_model=List[schemas.Category])
-def get_all_categories(db: Session = Depends(get_db)):
+def get_all_categories(db: Session = Depends(get_read_db)):
     return categories_crud.get_all_categories(db)
 
 
 @router.get("/{category_id}", response_model=Optional[schemas.Category])
-def get_category(category_id: int, db: Session = Depends(get_db)):
+def get_category(category_id: int, db: Session = Depends(get_read_db)):
     category = categories_crud.get_category(db, category_id)
     if category is None:
         raise HTTPException(
@@ -40,7 +40,7 @@ def get_category(category_id: int, db: Session = Depends(get_db)):
 
 
 @router.get("/{name}/name", response_model=Optional[schemas.Category])
-def get_category_by_name(name: str, db: Session = Depends(get_db)):
+def get_category_by_name(name: str, db: Session = Depends(get_read_db)):
     category = categories_crud.get_category_by_name(db, name)
     if category is None:
         raise HTTPException(
@@ -97,11 +97,17 @@ def update_category(
 ):
     try:
         category = categories_crud.get_category(db, id)
+
+        if category is None:
+            raise InvalidIDException(f"Category ID {id} does not exist")
+
         category_name = category.name
-        category = categories_crud.update_category(db, id, data.name.strip())
+        categories_crud.rename_category(db, category, data.name.strip())
 
-        for movie in category.movies:
-            rename_movie_file(movie, category_current=category_name)
+        # category names are not part of the filenames
+        rename_link_directory(
+            db, "categories", category_name, category.name, []
+        )
         db.commit()
 
     except DuplicateEntryException as e:
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends
+
+from .. import journal, links, schemas
+from ..base_db import Session
+from ..session import get_db
+
+router = APIRouter()
+
+
+@router.post("/links/check", response_model=schemas.LinkCheckReport)
+def check_links(repair: bool = False, db: Session = Depends(get_db)):
+    # queued edits would show up as broken links
+    journal.drain()
+
+    return links.check_links(db, repair)
@@ -1,19 +1,23 @@
-from typing import List, Union
+import json
+from typing import Dict, List, Optional, Tuple, Union
 
 from fastapi import APIRouter, Depends, status
 from fastapi.exceptions import HTTPException
+from fastapi.responses import Response, StreamingResponse
 
-from .. import schemas
+from .. import importer, jobs, schemas, writes
 from ..base_db import Session
 from ..config import get_config, get_logger
 from ..crud import movies_crud
 from ..exceptions import (
+    DatabaseBusyException,
     DuplicateEntryException,
     InvalidIDException,
     ListFilesException,
+    ParseException,
     PathException,
 )
-from ..session import get_db
+from ..session import get_db, get_read_db
 from ..utils import list_files, parse_file_info
 
 logger = get_logger()
@@ -24,9 +28,19 @@ config = get_config()
 router = APIRouter()
 
 
+def submit_movie_write(operation, *args) -> schemas.Movie:
+    # serialized inside the batch, its session is closed after the commit
+    return writes.submit(
+        lambda db: schemas.Movie.from_orm(operation(db, *args))
+    )
+
+
 @router.get("", response_model=List[schemas.MovieFile])
-def get_all_movies(db: Session = Depends(get_db)):
-    return movies_crud.get_all_movies(db)
+def get_all_movies(db: Session = Depends(get_read_db)):
+    # already json, the response model only documents it
+    return Response(
+        movies_crud.get_movie_files_json(db), media_type="application/json"
+    )
 
 
 @router.get(
@@ -39,7 +53,7 @@ def get_all_movies(db: Session = Depends(get_db)):
         }
     },
 )
-def get_movie(movie_id: int, db: Session = Depends(get_db)):
+def get_movie(movie_id: int, db: Session = Depends(get_read_db)):
     movie = movies_crud.get_movie_by_id(db, movie_id)
     if movie is None:
         raise HTTPException(
@@ -49,6 +63,26 @@ def get_movie(movie_id: int, db: Session = Depends(get_db)):
     return movie
 
 
+def list_import_files(
+    db: Session, since_last_scan: bool
+) -> Tuple[List[str], Optional[Dict]]:
+    try:
+        if since_last_scan:
+            scanned = importer.scan_new_files(db, config["imports"])
+            # a touched file that is already imported is skipped, it must
+            # not fail the rescan, and its new state is still recorded
+            existing = set(importer.get_existing_filenames(db, list(scanned)))
+            files = [file for file in scanned if file not in existing]
+            return (files, scanned)
+
+        return (list_files(config["imports"]), None)
+    except ListFilesException as e:
+        logger.warn(str(e))
+        raise HTTPException(
+            status.HTTP_500_INTERNAL_SERVER_ERROR, detail={"message": str(e)}
+        )
+
+
 @router.post(
     "",
     response_model=List[schemas.Movie],
@@ -57,21 +91,45 @@ def get_movie(movie_id: int, db: Session = Depends(get_db)):
             "model": schemas.HTTPExceptionSchema,
             "description": "Duplicate Movie",
         },
+        422: {
+            "model": schemas.HTTPExceptionSchema,
+            "description": "Unparsable Filename",
+        },
         500: {
             "model": schemas.HTTPExceptionSchema,
             "description": "Path Error",
         },
     },
 )
-def import_movies(db: Session = Depends(get_db)):
-    try:
-        files = list_files(config["imports"])
-    except ListFilesException as e:
-        logger.warn(str(e))
-        raise HTTPException(
-            status.HTTP_500_INTERNAL_SERVER_ERROR, detail={"message": str(e)}
-        )
+def import_movies(
+    bulk: bool = True,
+    since_last_scan: bool = False,
+    create_properties: bool = False,
+    db: Session = Depends(get_db),
+):
+    files, scanned = list_import_files(db, since_last_scan)
+
+    if bulk:
+        try:
+            movies = importer.bulk_import(db, files, create_properties)
+        except DuplicateEntryException as e:
+            logger.warn(str(e))
+            raise HTTPException(
+                status.HTTP_409_CONFLICT, detail={"message": str(e)}
+            )
+        except ParseException as e:
+            logger.warn(str(e))
+            raise HTTPException(
+                status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail={"message": str(e)},
+            )
+
+        if scanned is not None:
+            importer.record_scanned_files(db, scanned)
+
+        return movies
 
+    # per-file fallback, one commit per movie, only links known properties
     movies = []
 
     for file in files:
@@ -96,9 +154,76 @@ def import_movies(db: Session = Depends(get_db)):
                 detail={"message": str(e)},
             )
 
+    if scanned is not None:
+        importer.record_scanned_files(db, scanned)
+
     return movies
 
 
+@router.post(
+    "/stream",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}},
+            "description": "One JSON record per file, then a summary record",
+        },
+        500: {
+            "model": schemas.HTTPExceptionSchema,
+            "description": "Path Error",
+        },
+    },
+)
+def import_movies_stream(
+    since_last_scan: bool = False,
+    create_properties: bool = False,
+    db: Session = Depends(get_db),
+):
+    files, scanned = list_import_files(db, since_last_scan)
+
+    def records():
+        yield from importer.import_movies_iter(
+            db, files, create_properties=create_properties
+        )
+
+        if scanned is not None:
+            importer.record_scanned_files(db, scanned)
+
+    return StreamingResponse(
+        (json.dumps(record) + "\n" for record in records()),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.post(
+    "/import-jobs",
+    response_model=schemas.ImportJob,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+def submit_import_job(db: Session = Depends(get_db)):
+    return jobs.submit_import_job(db)
+
+
+@router.get(
+    "/import-jobs/{job_id}",
+    response_model=schemas.ImportJob,
+    responses={
+        404: {
+            "model": schemas.HTTPExceptionSchema,
+            "description": "Invalid ID",
+        }
+    },
+)
+def get_import_job(job_id: int, db: Session = Depends(get_read_db)):
+    job = jobs.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(
+            status.HTTP_404_NOT_FOUND,
+            detail={"message": f"Import job with id {job_id} does not exist"},
+        )
+    return job
+
+
 @router.put(
     "/{movie_id}",
     response_model=schemas.Movie,
@@ -111,15 +236,15 @@ def import_movies(db: Session = Depends(get_db)):
             "model": schemas.HTTPExceptionSchema,
             "description": "Path Error",
         },
+        503: {
+            "model": schemas.HTTPExceptionSchema,
+            "description": "Database Busy",
+        },
     },
 )
-def update_movie(
-    movie_id: int,
-    data: schemas.MovieUpdateSchema,
-    db: Session = Depends(get_db),
-):
+def update_movie(movie_id: int, data: schemas.MovieUpdateSchema):
     try:
-        movie = movies_crud.update_movie(db, movie_id, data)
+        movie = submit_movie_write(movies_crud.update_movie, movie_id, data)
     except InvalidIDException as e:
         logger.warn(str(e))
         raise HTTPException(
@@ -130,6 +255,11 @@ def update_movie(
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, detail={"message": str(e)}
         )
+    except DatabaseBusyException as e:
+        logger.warn(str(e))
+        raise HTTPException(
+            status.HTTP_503_SERVICE_UNAVAILABLE, detail={"message": str(e)}
+        )
 
     return movie
 
@@ -180,13 +310,17 @@ def delete_movie(movie_id: int, db: Session = Depends(get_db)):
             "model": schemas.HTTPExceptionSchema,
             "description": "Path Error",
         },
+        503: {
+            "model": schemas.HTTPExceptionSchema,
+            "description": "Database Busy",
+        },
     },
 )
-def add_movie_category(
-    movie_id: int, category_id: int, db: Session = Depends(get_db)
-):
+def add_movie_category(movie_id: int, category_id: int):
     try:
-        movie = movies_crud.add_movie_category(db, movie_id, category_id)
+        movie = submit_movie_write(
+            movies_crud.add_movie_category, movie_id, category_id
+        )
     except DuplicateEntryException as e:
         logger.warn(str(e))
         raise HTTPException(
@@ -202,6 +336,11 @@ def add_movie_category(
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, detail={"message": str(e)}
         )
+    except DatabaseBusyException as e:
+        logger.warn(str(e))
+        raise HTTPException(
+            status.HTTP_503_SERVICE_UNAVAILABLE, detail={"message": str(e)}
+        )
 
     return movie
 
@@ -218,13 +357,17 @@ def add_movie_category(
             "model": schemas.HTTPExceptionSchema,
             "description": "Path Error",
         },
+        503: {
+            "model": schemas.HTTPExceptionSchema,
+            "description": "Database Busy",
+        },
     },
 )
-def delete_movie_category(
-    movie_id: int, category_id: int, db: Session = Depends(get_db)
-):
+def delete_movie_category(movie_id: int, category_id: int):
     try:
-        movie = movies_crud.delete_movie_category(db, movie_id, category_id)
+        movie = submit_movie_write(
+            movies_crud.delete_movie_category, movie_id, category_id
+        )
     except InvalidIDException as e:
         logger.warn(str(e))
         raise HTTPException(
@@ -235,6 +378,11 @@ def delete_movie_category(
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, detail={"message": str(e)}
         )
+    except DatabaseBusyException as e:
+        logger.warn(str(e))
+        raise HTTPException(
+            status.HTTP_503_SERVICE_UNAVAILABLE, detail={"message": str(e)}
+        )
 
     return movie
 
@@ -255,13 +403,17 @@ def delete_movie_category(
             "model": schemas.HTTPExceptionSchema,
             "description": "Path Error",
         },
+        503: {
+            "model": schemas.HTTPExceptionSchema,
+            "description": "Database Busy",
+        },
     },
 )
-def add_movie_actor(
-    movie_id: int, actor_id: int, db: Session = Depends(get_db)
-):
+def add_movie_actor(movie_id: int, actor_id: int):
     try:
-        movie = movies_crud.add_movie_actor(db, movie_id, actor_id)
+        movie = submit_movie_write(
+            movies_crud.add_movie_actor, movie_id, actor_id
+        )
     except DuplicateEntryException as e:
         logger.warn(str(e))
         raise HTTPException(
@@ -277,6 +429,11 @@ def add_movie_actor(
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, detail={"message": str(e)}
         )
+    except DatabaseBusyException as e:
+        logger.warn(str(e))
+        raise HTTPException(
+            status.HTTP_503_SERVICE_UNAVAILABLE, detail={"message": str(e)}
+        )
 
     return movie
 
@@ -293,13 +450,17 @@ def add_movie_actor(
             "model": schemas.HTTPExceptionSchema,
             "description": "Path Error",
         },
+        503: {
+            "model": schemas.HTTPExceptionSchema,
+            "description": "Database Busy",
+        },
     },
 )
-def delete_movie_actor(
-    movie_id: Union[int, str], actor_id: int, db: Session = Depends(get_db)
-):
+def delete_movie_actor(movie_id: Union[int, str], actor_id: int):
     try:
-        movie = movies_crud.delete_movie_actor(db, movie_id, actor_id)
+        movie = submit_movie_write(
+            movies_crud.delete_movie_actor, movie_id, actor_id
+        )
     except InvalidIDException as e:
         logger.warn(str(e))
         raise HTTPException(
@@ -310,5 +471,10 @@ def delete_movie_actor(
         raise HTTPException(
             status.HTTP_500_INTERNAL_SERVER_ERROR, detail={"message": str(e)}
         )
+    except DatabaseBusyException as e:
+        logger.warn(str(e))
+        raise HTTPException(
+            status.HTTP_503_SERVICE_UNAVAILABLE, detail={"message": str(e)}
+        )
 
     return movie
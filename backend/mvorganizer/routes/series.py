@@ -6,15 +6,15 @@ from fastapi.exceptions import HTTPException
 from .. import schemas
 from ..base_db import Session
 from ..config import get_logger
-from ..crud import series_crud
+from ..crud import movies_crud, series_crud
 from ..exceptions import (
     DuplicateEntryException,
     IntegrityConstraintException,
     InvalidIDException,
     PathException,
 )
-from ..session import get_db
-from ..utils import rename_movie_file
+from ..session import get_db, get_read_db
+from ..utils import rename_link_directory
 
 logger = get_logger()
 
@@ -22,13 +22,13 @@ router = APIRouter()
 
 
 @router.get("", response_model=List[schemas.Series])
-def get_all_series(db: Session = Depends(get_db)):
+def get_all_series(db: Session = Depends(get_read_db)):
     return series_crud.get_all_series(db)
 
 
 @router.get("/{series_id}", response_model=schemas.Series)
-def get_all_series(*, db: Session = Depends(get_db), series_id: int):
-    return series_crud.get_series(db, id)
+def get_all_series(*, db: Session = Depends(get_read_db), series_id: int):
+    return series_crud.get_series(db, series_id)
 
 
 @router.post(
@@ -107,11 +107,20 @@ def update_series(
 ):
     try:
         series = series_crud.get_series(db, id)
-        series_name = series.name
-        series = series_crud.update_series(db, id, data.name.strip())
 
-        for movie in series.movies:
-            rename_movie_file(movie, series_current=series_name)
+        if series is None:
+            raise InvalidIDException(f"Series ID {id} does not exist")
+
+        series_name = series.name
+        series_crud.rename_series(db, series, data.name.strip())
+
+        rename_link_directory(
+            db,
+            "series",
+            series_name,
+            series.name,
+            movies_crud.get_movies_by_series(db, series.id),
+        )
         db.commit()
     except DuplicateEntryException as e:
         logger.warn(str(e))
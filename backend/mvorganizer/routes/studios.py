@@ -6,15 +6,15 @@ from fastapi.exceptions import HTTPException
 from .. import schemas
 from ..base_db import Session
 from ..config import get_logger
-from ..crud import studios_crud
+from ..crud import movies_crud, studios_crud
 from ..exceptions import (
     DuplicateEntryException,
     IntegrityConstraintException,
     InvalidIDException,
     PathException,
 )
-from ..session import get_db
-from ..utils import rename_movie_file
+from ..session import get_db, get_read_db
+from ..utils import rename_link_directory
 
 logger = get_logger()
 
@@ -22,17 +22,17 @@ router = APIRouter()
 
 
 @router.get("", response_model=List[schemas.Studio])
-def get_all_studios(db: Session = Depends(get_db)):
+def get_all_studios(db: Session = Depends(get_read_db)):
     return studios_crud.get_all_studios(db)
 
 
 @router.get("/{studio_id}", response_model=schemas.Studio)
-def get_studio_by_id(*, db: Session = Depends(get_db), studio_id: int):
+def get_studio_by_id(*, db: Session = Depends(get_read_db), studio_id: int):
     return studios_crud.get_studio_by_id(studio_id, db)
 
 
 @router.get("/{name}/name", response_model=schemas.Studio)
-def get_studio_by_name(*, db: Session = Depends(get_db), name: str):
+def get_studio_by_name(*, db: Session = Depends(get_read_db), name: str):
     return studios_crud.get_studio_by_name(name, db)
 
 
@@ -113,12 +113,20 @@ def update_studio(
 
     try:
         studio = studios_crud.get_studio_by_id(id, db)
-        studio_name = studio.name
 
-        studio = studios_crud.update_studio(db, id, data.name.strip())
+        if studio is None:
+            raise InvalidIDException(f"Studio ID {id} does not exist")
 
-        for movie in studio.movies:
-            rename_movie_file(movie, studio_current=studio_name)
+        studio_name = studio.name
+        studios_crud.rename_studio(db, studio, data.name.strip())
+
+        rename_link_directory(
+            db,
+            "studios",
+            studio_name,
+            studio.name,
+            movies_crud.get_movies_by_studio(db, studio.id),
+        )
 
         db.commit()
     except DuplicateEntryException as e:
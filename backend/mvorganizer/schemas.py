@@ -1,11 +1,15 @@
+import json
+from datetime import datetime
 from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 
 
 class BaseMovie(BaseModel):
     id: int
     filename: str
+    # renames and links still waiting for the write-behind journal
+    fs_pending: bool = False
 
     class Config:
         orm_mode = True
@@ -62,6 +66,52 @@ class MovieUpdateSchema(BaseModel):
     studio_id: Optional[int] = None
 
 
+class ImportJob(BaseModel):
+    id: int
+    directory: str
+    status: str
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    total: int
+    processed: int
+    imported: int
+    duplicates: int
+    failed: int
+    throughput: float
+    errors: List[str]
+
+    class Config:
+        orm_mode = True
+
+    @validator("errors", pre=True)
+    def load_errors(cls, value):
+        return json.loads(value) if isinstance(value, str) else value
+
+
+class LinkIssues(BaseModel):
+    count: int
+    links: List[str]
+
+
+class LinkTreeReport(BaseModel):
+    tree: str
+    links: int
+    expected: int
+    missing: LinkIssues
+    extra: LinkIssues
+    dangling: LinkIssues
+
+
+class LinkCheckReport(BaseModel):
+    trees: List[LinkTreeReport]
+    repairable: int
+    repaired: int
+    errors: List[str]
+    elapsed: float
+    throughput: float
+
+
 class HTTPExceptionMessage(BaseModel):
     message: str
 
@@ -1,15 +1,30 @@
 import logging
 
-from .base_db import SessionLocal
+from sqlalchemy.orm import sessionmaker
+
+from .base_db import ReadSessionLocal, SessionLocal, reopen_if_replaced
+from .filesystem import get_filesystem
 
 logger = logging.getLogger(__name__)
 
 
-def get_db():
-    db = SessionLocal()
+def open_session(session_factory: sessionmaker):
+    reopen_if_replaced()
+    get_filesystem().reopen_if_replaced()
+
+    db = session_factory()
     try:
         yield db
     except Exception as e:
         logger.error(f"sqlalchemy error: {str(e)}")
     finally:
         db.close()
+
+
+def get_db():
+    yield from open_session(SessionLocal)
+
+
+def get_read_db():
+    # served by the reader pool, so a long write does not block these
+    yield from open_session(ReadSessionLocal)
@@ -1,21 +1,30 @@
 import logging
 import os
 import re
-from pathlib import Path
-from typing import List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, List, NamedTuple, Optional, Tuple
 
-from . import models
+from . import journal, models
 from .base_db import Session
 from .config import get_config
 from .crud.actors import get_actor_by_name
 from .crud.series import get_series_by_name
 from .crud.studios import get_studio_by_name
 from .exceptions import ListFilesException, PathException
+from .links import LinkPlan
 
 config = get_config()
 
 logger = logging.getLogger(__name__)
 
+# characters allowed in each part of a movie filename
+INVALID_FILENAME_CHAR = re.compile(r"[^A-Za-z0-9 .,'-]")
+
+# below this many filenames a process pool costs more than it saves
+PARSE_PARALLEL_MIN = 20000
+PARSE_CHUNK_SIZE = 5000
+
 
 def list_files(path: str) -> List[str]:
     try:
@@ -26,36 +35,39 @@ def list_files(path: str) -> List[str]:
     return files
 
 
-def migrate_file(movie: models.Movie, adding: bool = True):
-    base_current = config["imports"] if adding else config["movies"]
-    base_new = config["movies"] if adding else config["imports"]
-
-    path_current = f"{base_current}/{movie.filename}"
-    path_new = f"{base_new}/{movie.filename}"
-
-    if os.path.exists(path_new):
-        raise PathException(
-            f"Unable to move {path_current} -> {path_new} as it already exists"
-        )
+def scan_files(path: str) -> List[str]:
+    # unsorted, for callers that only need membership
+    try:
+        with os.scandir(path) as entries:
+            return [entry.name for entry in entries]
+    except OSError:
+        raise ListFilesException(f"Unable to read path {path}")
 
-    logger.info(f"migrating {path_current} -> {path_new}")
-    os.rename(path_current, path_new)
 
+def remove_movie(movie: models.Movie, plan: Optional[LinkPlan] = None) -> None:
+    apply = plan is None
+    plan = LinkPlan() if plan is None else plan
 
-def remove_movie(movie: models.Movie) -> None:
-    migrate_file(movie, False)
+    logger.info(
+        f"migrating {plan.describe('movies', movie.filename)} -> "
+        f"{plan.describe('imports', movie.filename)}"
+    )
+    plan.move("movies", movie.filename, "imports", movie.filename)
 
     for actor in movie.actors:
-        update_actor_link(movie.filename, actor.name, False)
+        plan.actor(movie.filename, actor.name, False)
 
     for category in movie.categories:
-        update_category_link(movie.filename, category.name, False)
+        plan.category(movie.filename, category.name, False)
 
     if movie.series is not None:
-        update_series_link(movie.filename, movie.series.name, False)
+        plan.series(movie.filename, movie.series.name, False)
 
     if movie.studio is not None:
-        update_studio_link(movie.filename, movie.studio.name, False)
+        plan.studio(movie.filename, movie.studio.name, False)
+
+    if apply:
+        plan.apply()
 
 
 def generate_movie_filename(movie: models.Movie) -> str:
@@ -106,23 +118,31 @@ def rename_movie_file(
     series_current: Optional[str] = None,
     category_current: Optional[str] = None,
     studio_current: Optional[str] = None,
+    plan: Optional[LinkPlan] = None,
+    db: Optional[Session] = None,
 ) -> None:
+    # without a plan from the caller the changes are applied right away
+    apply = plan is None
+    plan = LinkPlan() if plan is None else plan
+
     filename_current = movie.filename
     filename_new = generate_movie_filename(movie)
 
-    path_base = config["movies"]
-    path_current = f"{path_base}/{filename_current}"
-    path_new = f"{path_base}/{filename_new}"
-
-    path_changed: bool = path_current != path_new
+    path_changed: bool = filename_current != filename_new
 
     if path_changed:
-        if os.path.exists(path_new):
+        # journaled moves are not on disk yet, the database is ahead of it
+        if db is not None and journal.write_behind():
+            taken = journal.movie_file_taken(db, movie.id, filename_new)
+        else:
+            taken = plan.filesystem.exists("movies", filename_new)
+
+        if taken:
             raise PathException(
                 f"Unable to rename {movie.filename} as {filename_new} already exists"
             )
 
-        os.rename(path_current, path_new)
+        plan.move("movies", filename_current, "movies", filename_new)
         movie.filename = filename_new
 
         actor: models.Actor
@@ -130,102 +150,95 @@ def rename_movie_file(
         series: models.Series
         studios: models.Studio
 
-        for actor in movie.actors:
-            if actor_current is None:
-                actor_current = actor.name
+        if actor_current is not None:
+            plan.actor(filename_current, actor_current, False)
 
-            update_actor_link(filename_current, actor_current, False)
-            update_actor_link(filename_new, actor.name, True)
+        for actor in movie.actors:
+            plan.actor(filename_current, actor.name, False)
+            plan.actor(filename_new, actor.name, True)
 
         if movie.series is not None:
             if series_current is None:
                 series_current = movie.series.name
 
-            update_series_link(filename_current, series_current, False)
-            update_series_link(filename_new, movie.series.name, True)
+            plan.series(filename_current, series_current, False)
+            plan.series(filename_new, movie.series.name, True)
 
         if movie.studio is not None:
             if studio_current is None:
                 studio_current = movie.studio.name
-            update_studio_link(filename_current, studio_current, False)
-            update_studio_link(filename_new, movie.studio.name, True)
+            plan.studio(filename_current, studio_current, False)
+            plan.studio(filename_new, movie.studio.name, True)
 
     if path_changed or category_current is not None:
+        if category_current is not None:
+            plan.category(filename_current, category_current, False)
+
         for category in movie.categories:
-            if category_current is None:
-                category_current = category.name
+            plan.category(filename_current, category.name, False)
+            plan.category(filename_new, category.name, True)
+
+    if apply:
+        try:
+            plan.apply()
+        except PathException:
+            movie.filename = filename_current
+            raise
+
+
+def rename_link_directory(
+    db: Session,
+    tree: str,
+    name_current: str,
+    name_new: str,
+    movies: List[models.Movie],
+) -> None:
+    # one directory rename moves every link, only the movies whose
+    # generated filename changes get renamed on top of that
+    plan = LinkPlan(workers=int(config.get("rename_workers", 8)))
 
-            update_category_link(filename_current, category_current, False)
-            update_category_link(filename_new, category.name, True)
+    if name_current != name_new:
+        plan.rename_directory(tree, name_current, name_new)
 
+    for movie in movies:
+        rename_movie_file(movie, plan=plan, db=db)
 
-def update_link(
-    filename: str, path_link_base: str, name: str, selected: bool
-) -> None:
-    path_movies = os.path.abspath(config["movies"])
-    path_file = f"{path_movies}/{filename}"
-
-    path_base = f"{path_link_base}/{name}"
-    path_link = f"{path_base}/{filename}"
-
-    if selected:
-        if not os.path.isdir(path_base):
-            try:
-                path = Path(path_base)
-                path.mkdir(parents=True, exist_ok=True)
-            except:
-                raise PathException(
-                    f"Link directory {path_base} could not be created"
-                )
-
-        if not os.path.lexists(path_link):
-            try:
-                os.symlink(path_file, path_link)
-            except:
-                raise PathException(
-                    f"Unable to create link {path_file} -> {path_link}"
-                )
-    else:
-        if os.path.lexists(path_link):
-            try:
-                os.remove(path_link)
-            except:
-                raise PathException(
-                    f"Unable to delete link {path_file} -> {path_link}"
-                )
+    # with write-behind the worker renames, the writer is not held for it
+    journal.record_plan(db, plan, None)
 
-            try:
-                os.rmdir(path_base)
-            except:
-                pass
+
+def update_link(filename: str, tree: str, name: str, selected: bool) -> None:
+    plan = LinkPlan()
+    plan.link(tree, name, filename, selected)
+    plan.apply()
 
 
 def update_actor_link(filename: str, name: str, selected: bool) -> None:
     try:
-        update_link(filename, config["actors"], name, selected)
+        update_link(filename, "actors", name, selected)
     except Exception as e:
-        logger.info(str(e))
+        logger.warn(str(e))
 
 
 def update_category_link(filename: str, name: str, selected: bool) -> None:
     try:
-        update_link(filename, config["categories"], name, selected)
+        update_link(filename, "categories", name, selected)
     except Exception as e:
-        logger.info(str(e))
+        logger.warn(str(e))
 
 
 def update_series_link(filename: str, name: str, selected: bool) -> None:
     try:
-        update_link(filename, config["series"], name, selected)
+        update_link(filename, "series", name, selected)
     except Exception as e:
-        logger.info(str(e))
+        logger.warn(str(e))
 
 
 def update_studio_link(filename: str, name: str, selected: bool) -> None:
     try:
-        update_link(filename, config["studios"], name, selected)
+        update_link(filename, "studios", name, selected)
     except Exception as e:
-        logger.info(str(e))
+        logger.warn(str(e))
 
 
 def generate_sort_name(name: str) -> str:
@@ -236,41 +249,158 @@ def generate_sort_name(name: str) -> str:
     )
 
 
+def parse_filename_tail(
+    text: str, position: int, end: int, spaces: int
+) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    # matches " ?" * spaces "MovieName ?(Actor1, ..., ActorN)" in
+    # text[position:end], picking the shortest name like the lazy "+?"
+    start = position
+    while start - position < spaces and text.startswith(" ", start, end):
+        start += 1
+
+    actors_start = -1
+    actor_names = None
+
+    if text.endswith(")", position, end):
+        actors_start = text.rfind("(", position, end)
+
+        if actors_start == -1 or actors_start + 2 >= end:
+            actors_start = -1
+        elif INVALID_FILENAME_CHAR.search(text, actors_start + 1, end - 1):
+            actors_start = -1
+        else:
+            actor_names = text[actors_start + 1 : end - 1]
+
+    invalid = INVALID_FILENAME_CHAR.search(text, position, end)
+    name_end = end if invalid is None else invalid.start()
+
+    # the name can only stop right before the actors or the end of text
+    if actors_start != -1:
+        stops = (actors_start - 1, actors_start)
+    elif text.endswith(" ", position, end):
+        stops = (end - 1, end)
+    else:
+        stops = (end,)
+
+    # fall back to fewer leading spaces, the name may start with one
+    for start in range(start, position - 1, -1):
+        for stop in stops:
+            if start < stop <= name_end and (
+                stop != actors_start - 1 or text[stop] == " "
+            ):
+                return (text[start:stop], actor_names)
+
+        if start == end or (start + 1 == end and text[start] == " "):
+            return (None, None)
+
+        if actors_start == start or (
+            actors_start == start + 1 and text[start] == " "
+        ):
+            return (None, actor_names)
+
+    return None
+
+
 def parse_filename(
     filename: str,
 ) -> Tuple[str, Optional[str], Optional[str], Optional[str], Optional[str]]:
     name, _ = os.path.splitext(filename)
 
     # [Studio] {Series Series#} MovieName (Actor1, Actor2, ..., ActorN)
-    regex = (
-        r"^"  # Start of line
-        r"(?:\[([A-Za-z0-9 .,\'-]+)\])?"  # Optional studio
-        r" ?"  # Optional space
-        r"(?:{([A-Za-z0-9 .,\'-]+?)(?: ([0-9]+))?})?"  # Optional series name/#
-        r" ?"  # Optional space
-        r"([A-Za-z0-9 .,\'-]+?)?"  # Optional novie Name
-        r" ?"  # Optional space
-        r"(?:\(([A-Za-z0-9 .,\'-]+)\))?"  # Optional actor list
-        r"$"  # End of line
-    )
+    # tokenized in a single pass, a trailing newline is ignored like the
+    # "$" of the expression this replaces did
+    end = len(name) - 1 if name.endswith("\n") else len(name)
+    position = 0
 
     studio_name = None
     series_name = None
     series_number = None
-    actor_names = None
 
-    matches = re.search(regex, name)
+    if name.startswith("["):
+        close = name.find("]", 1, end)
+
+        if close < 2 or INVALID_FILENAME_CHAR.search(name, 1, close):
+            return (name, None, None, None, None)
+
+        studio_name = name[1:close]
+        position = close + 1
+
+    brace = position + 1 if name.startswith(" ", position, end) else position
+    spaces = 2
+
+    if name.startswith("{", brace, end):
+        close = name.find("}", brace, end)
+
+        if close < brace + 2 or INVALID_FILENAME_CHAR.search(
+            name, brace + 1, close
+        ):
+            return (name, None, None, None, None)
+
+        series_name = name[brace + 1 : close]
+        split = series_name.rfind(" ")
+
+        if split > 0:
+            number = series_name[split + 1 :]
+
+            if number.isascii() and number.isdigit():
+                series_name = series_name[:split]
+                series_number = number
+
+        position = close + 1
+        spaces = 1
+
+    tail = parse_filename_tail(name, position, end, spaces)
+
+    if tail is None:
+        return (name, None, None, None, None)
+
+    movie_name, actor_names = tail
+
+    return (movie_name, studio_name, series_name, series_number, actor_names)
+
+
+class ParsedFilenames(NamedTuple):
+    names: List[Optional[str]]
+    studios: List[Optional[str]]
+    series: List[Optional[str]]
+    numbers: List[Optional[str]]
+    actors: List[Optional[str]]
+
+
+def parse_filename_chunk(filenames: List[str]) -> ParsedFilenames:
+    if len(filenames) == 0:
+        return ParsedFilenames([], [], [], [], [])
+
+    return ParsedFilenames(
+        *(list(column) for column in zip(*map(parse_filename, filenames)))
+    )
+
+
+def parse_filenames(
+    filenames: Iterable[str],
+    workers: Optional[int] = None,
+    chunk_size: int = PARSE_CHUNK_SIZE,
+) -> ParsedFilenames:
+    filenames = list(filenames)
+
+    if workers is None:
+        workers = int(config.get("parse_workers", os.cpu_count() or 1))
+
+    if workers <= 1 or len(filenames) < PARSE_PARALLEL_MIN:
+        return parse_filename_chunk(filenames)
+
+    iterator = iter(filenames)
+    chunks = iter(lambda: list(islice(iterator, chunk_size)), [])
+    parsed = ParsedFilenames([], [], [], [], [])
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(parse_filename_chunk, chunks):
+            for column, values in zip(parsed, result):
+                column.extend(values)
 
-    if matches is not None:
-        (
-            studio_name,
-            series_name,
-            series_number,
-            name,
-            actor_names,
-        ) = matches.groups()
+    logger.info("Parsed %d filenames with %d workers", len(filenames), workers)
 
-    return (name, studio_name, series_name, series_number, actor_names)
+    return parsed
 
 
 def parse_file_info(
@@ -296,7 +426,7 @@ def parse_file_info(
     ) = parse_filename(filename)
 
     if studio_name is not None:
-        studio = get_studio_by_name(db, studio_name)
+        studio = get_studio_by_name(studio_name, db)
 
         if studio is not None:
             studio_id = studio.id
@@ -311,7 +441,7 @@ def parse_file_info(
         actors = [
             actor
             for actor in (
-                get_actor_by_name(db, actor_name)
+                get_actor_by_name(actor_name, db)
                 for actor_name in actor_names.split(", ")
             )
             if actor is not None
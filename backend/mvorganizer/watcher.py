@@ -0,0 +1,232 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+from threading import Event, Thread
+from typing import Dict, Optional, Set
+
+from . import importer
+from .base_db import SessionLocal, reopen_if_replaced
+from .config import get_config, init
+from .exceptions import ListFilesException
+
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+# linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    def __init__(self, path: str, mask: int):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {path}")
+
+    def read(self, timeout: float) -> Optional[Set[str]]:
+        # names of the files with events, None when the queue overflowed
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        names = set()
+
+        if not readable:
+            return names
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return names
+
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+
+            if mask & IN_Q_OVERFLOW:
+                return None
+
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            if name:
+                names.add(os.fsdecode(name))
+
+        return names
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class ImportWatcher:
+    def __init__(
+        self,
+        directory: str,
+        debounce: float = 2.0,
+        poll_interval: float = 30.0,
+    ):
+        self.directory = directory
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.stopped = Event()
+        self.thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        self.thread = Thread(
+            target=self.run, name="import-watcher", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self) -> None:
+        try:
+            inotify = Inotify(self.directory, IN_CLOSE_WRITE | IN_MOVED_TO)
+        except (AttributeError, OSError) as e:
+            logger.warn(
+                "inotify unavailable (%s), polling %s every %ss",
+                e,
+                self.directory,
+                self.poll_interval,
+            )
+            self.import_new_files()
+            while not self.stopped.wait(self.poll_interval):
+                self.import_new_files()
+            return
+
+        logger.info("Watching %s for new movie files", self.directory)
+
+        try:
+            # pick up whatever arrived while nobody was watching, files
+            # landing during the scan are already queued as events
+            self.import_new_files()
+            self.watch(inotify)
+        finally:
+            inotify.close()
+
+    def watch(self, inotify: Inotify) -> None:
+        pending: Dict[str, float] = {}
+
+        while not self.stopped.is_set():
+            names = inotify.read(self.debounce if pending else 1.0)
+
+            if names is None:
+                logger.warn("inotify queue overflowed, rescanning")
+                pending.clear()
+                self.import_new_files()
+                continue
+
+            now = time.monotonic()
+            for name in names:
+                pending[name] = now
+
+            if not pending:
+                continue
+
+            # wait for a burst to go quiet, but not forever on a trickle
+            quiet = now - max(pending.values()) >= self.debounce
+            overdue = now - min(pending.values()) >= self.debounce * 10
+
+            if not (quiet or overdue):
+                continue
+
+            ready = [
+                name
+                for name, seen in pending.items()
+                if now - seen >= self.debounce
+            ]
+
+            for name in ready:
+                del pending[name]
+
+            if ready:
+                self.import_files(ready)
+
+    def import_new_files(self) -> None:
+        db = SessionLocal()
+
+        try:
+            scanned = importer.scan_new_files(db, self.directory)
+            self.run_import(db, scanned)
+        except ListFilesException as e:
+            logger.error(str(e))
+        except Exception:
+            # the rescans run on the watcher thread, which must survive them
+            logger.exception("Auto-import from %s failed", self.directory)
+        finally:
+            db.close()
+
+    def import_files(self, names) -> None:
+        scanned = importer.stat_files(self.directory, names)
+        db = SessionLocal()
+
+        try:
+            # a deleted movie moved back here by the app is not new
+            scanned = importer.drop_recorded_files(db, scanned)
+            self.run_import(db, scanned)
+        except Exception:
+            logger.exception("Auto-import from %s failed", self.directory)
+        finally:
+            db.close()
+
+    def run_import(self, db, scanned: Dict) -> None:
+        if len(scanned) == 0:
+            return
+
+        reopen_if_replaced()
+
+        for record in importer.import_movies_iter(
+            db, list(scanned), directory=self.directory
+        ):
+            if record["status"] == "summary":
+                logger.info(
+                    "Auto-imported %d of %d new files from %s",
+                    record["imported"],
+                    record["total"],
+                    self.directory,
+                )
+
+        importer.record_scanned_files(db, scanned)
+
+
+def create_watcher() -> ImportWatcher:
+    return ImportWatcher(
+        config["imports"],
+        float(config.get("watch_debounce", 2.0)),
+        float(config.get("watch_poll_interval", 30.0)),
+    )
+
+
+def run():
+    init()
+
+    watcher = create_watcher()
+
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,185 @@
+import logging
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+from threading import Lock, Thread
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, sessionmaker
+
+from .base_db import SessionLocal, reopen_if_replaced
+from .config import get_config
+from .exceptions import DatabaseBusyException
+from .filesystem import get_filesystem
+
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+# first wait after the write lock was busy, doubled on every retry
+WRITE_BUSY_BACKOFF = 0.05
+
+Operation = Callable[[Session], Any]
+
+
+def is_busy(e: OperationalError) -> bool:
+    return "database is locked" in str(e.orig)
+
+
+class WriteQueue:
+    def __init__(
+        self,
+        batch_size: int = 64,
+        window: float = 0.002,
+        retries: int = 5,
+        session_factory: sessionmaker = SessionLocal,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.window = window
+        self.retries = retries
+        self.queue: "Queue[Optional[Tuple[Operation, Future]]]" = Queue()
+        self.lock = Lock()
+        self.thread: Optional[Thread] = None
+
+    def submit(self, operation: Operation) -> Any:
+        # started by the first write, so scripts need no startup hook
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(
+                    target=self.run, name="write-queue", daemon=True
+                )
+                self.thread.start()
+
+        future: Future = Future()
+        self.queue.put((operation, future))
+
+        return future.result()
+
+    def stop(self) -> None:
+        with self.lock:
+            if self.thread is None:
+                return
+
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def collect(self, first: Tuple[Operation, Future]) -> Tuple[List, bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.window
+
+        # whatever is queued already joins, then wait out the window
+        while len(batch) < self.batch_size:
+            remaining = max(deadline - time.monotonic(), 0)
+
+            try:
+                item = self.queue.get(timeout=remaining)
+            except Empty:
+                break
+
+            if item is None:
+                return batch, True
+
+            batch.append(item)
+
+        return batch, False
+
+    def run(self) -> None:
+        stopping = False
+
+        while not stopping:
+            item = self.queue.get()
+
+            if item is None:
+                break
+
+            batch, stopping = self.collect(item)
+
+            try:
+                self.apply(batch)
+            except DatabaseBusyException as e:
+                self.fail(batch, e)
+            except Exception as e:
+                logger.exception("Write batch of %d failed", len(batch))
+                self.fail(batch, e)
+
+    def fail(self, batch: List[Tuple[Operation, Future]], e: Exception):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+
+    def apply(self, batch: List[Tuple[Operation, Future]]) -> None:
+        reopen_if_replaced()
+        get_filesystem().reopen_if_replaced()
+
+        db = self.session_factory()
+
+        try:
+            self.begin(db)
+            results = []
+
+            # each operation gets a savepoint, a failing one only undoes
+            # its own changes
+            for operation, _ in batch:
+                savepoint = db.begin_nested()
+
+                try:
+                    results.append((operation(db), None))
+                    savepoint.commit()
+                except Exception as e:
+                    savepoint.rollback()
+                    results.append((None, e))
+
+            db.commit()
+        finally:
+            db.close()
+
+        for (_, future), (result, error) in zip(batch, results):
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+        logger.debug("Committed %d writes in one transaction", len(batch))
+
+    def begin(self, db: Session) -> None:
+        # the write lock is taken before any operation runs, so a busy
+        # database is retried without repeating file changes
+        for attempt in range(self.retries + 1):
+            try:
+                db.connection().exec_driver_sql("begin immediate")
+                return
+            except PoolTimeoutError:
+                # the one writer connection stayed checked out for the whole
+                # pool timeout, a long rename or import holds it
+                raise DatabaseBusyException(
+                    "Database is busy with another write"
+                )
+            except OperationalError as e:
+                if not is_busy(e):
+                    raise
+
+                db.rollback()
+
+                if attempt == self.retries:
+                    raise DatabaseBusyException(
+                        "Database is locked by another process"
+                    )
+
+                delay = WRITE_BUSY_BACKOFF * 2**attempt
+                logger.warn("Database is locked, retrying in %.2fs", delay)
+                time.sleep(delay)
+
+
+write_queue = WriteQueue(
+    batch_size=int(config.get("write_batch_size", 64)),
+    window=float(config.get("write_batch_ms", 2)) / 1000,
+    retries=int(config.get("write_busy_retries", 5)),
+)
+
+
+def submit(operation: Operation) -> Any:
+    return write_queue.submit(operation)
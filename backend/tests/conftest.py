@@ -0,0 +1,88 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+import pytest
+import yaml
+
+# mvorganizer reads its config on import, point it at a throwaway tree
+base = tempfile.mkdtemp(prefix="mvorganizer-tests-")
+atexit.register(shutil.rmtree, base, True)
+
+ROOTS = ("imports", "movies", "actors", "categories", "series", "studios")
+
+QUERY_KINDS = ("select", "insert", "update", "delete")
+
+config = {root: os.path.join(base, "db", root) for root in ROOTS}
+config["sqlite_db"] = os.path.join(base, "movies.db")
+
+with open(os.path.join(base, "config.yaml"), "w") as f:
+    yaml.safe_dump(config, f)
+
+os.environ["MOVIE_ORGANIZER_PATH"] = os.path.join(base, "config.yaml")
+os.environ["MOVIE_ORGANIZER_LOGGING_PATH"] = os.path.join(
+    os.path.dirname(__file__), "..", "logging.yaml"
+)
+
+
+@pytest.fixture
+def library():
+    # an empty database and movie tree for every test
+    from mvorganizer import models
+    from mvorganizer.base_db import engine
+    from mvorganizer.filesystem import get_filesystem
+
+    shutil.rmtree(os.path.join(base, "db"), ignore_errors=True)
+
+    for root in ROOTS:
+        os.makedirs(config[root])
+
+    # the roots are new directories, drop the fds of the old ones
+    get_filesystem().close()
+
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as connection:
+        for table in reversed(models.Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+
+    return config
+
+
+@pytest.fixture
+def client(library):
+    from fastapi.testclient import TestClient
+    from mvorganizer.main import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def queries(library):
+    # statements run on every connection, traced by sqlite itself so raw
+    # cursor queries and the write queue's count as well
+    from mvorganizer.base_db import engine, read_engine
+    from sqlalchemy import event
+
+    statements = []
+
+    def trace(statement):
+        kind = statement.lstrip().split(" ", 1)[0].lower()
+
+        if kind in QUERY_KINDS:
+            statements.append(statement)
+
+    def on_connect(connection, _):
+        connection.set_trace_callback(trace)
+
+    for traced in (engine, read_engine):
+        event.listen(traced, "connect", on_connect)
+        traced.dispose()
+
+    yield statements
+
+    for traced in (engine, read_engine):
+        event.remove(traced, "connect", on_connect)
+        traced.dispose()
@@ -0,0 +1,51 @@
+import os
+import shutil
+
+from mvorganizer import filesystem
+from mvorganizer.filesystem import DirectoryFilesystem
+
+
+def test_roots_are_not_checked_on_every_call(library, monkeypatch):
+    fs = DirectoryFilesystem(library)
+    fs.symlink("target", "actors", "link")
+    fs.reopen_if_replaced()
+
+    stats = []
+    stat = os.stat
+
+    def counting_stat(*args, **kwargs):
+        stats.append(args)
+        return stat(*args, **kwargs)
+
+    monkeypatch.setattr(filesystem.os, "stat", counting_stat)
+
+    for _ in range(100):
+        fs.reopen_if_replaced()
+
+    assert stats == []
+
+
+def test_replaced_root_is_reopened_after_the_interval(library, monkeypatch):
+    fs = DirectoryFilesystem(library)
+    fs.symlink("target", "actors", "link")
+    fs.reopen_if_replaced()
+
+    os.rename(library["actors"], library["actors"] + ".old")
+    os.mkdir(library["actors"])
+
+    monkeypatch.setattr(filesystem, "ROOT_CHECK_INTERVAL", 0.0)
+    fs.reopen_if_replaced()
+
+    assert fs.listdir("actors") == []
+
+
+def test_deleted_root_is_reopened_on_failure(library):
+    fs = DirectoryFilesystem(library)
+    fs.symlink("target", "actors", "link")
+    fs.reopen_if_replaced()
+
+    shutil.rmtree(library["actors"])
+    os.mkdir(library["actors"])
+    fs.symlink("target", "actors", "link")
+
+    assert os.listdir(library["actors"]) == ["link"]
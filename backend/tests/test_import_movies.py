@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+
+def touch(library, name):
+    open(os.path.join(library["imports"], name), "w").close()
+
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_rescan_skips_imported_files(client, library, bulk):
+    params = {"since_last_scan": True, "bulk": bulk}
+    touch(library, "[Acme] Film.mp4")
+
+    response = client.post("/movies", params=params)
+    assert [movie["filename"] for movie in response.json()] == [
+        "[Acme] Film.mp4"
+    ]
+
+    # a changed file that is already in the database is not a conflict
+    os.utime(os.path.join(library["imports"], "[Acme] Film.mp4"), (0, 0))
+    touch(library, "[Acme] Other.mp4")
+
+    response = client.post("/movies", params=params)
+    assert response.status_code == 200
+    assert [movie["filename"] for movie in response.json()] == [
+        "[Acme] Other.mp4"
+    ]
+
+    response = client.post("/movies", params=params)
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+def test_full_import_reports_duplicates(client, library):
+    touch(library, "[Acme] Film.mp4")
+
+    assert client.post("/movies").status_code == 200
+    assert client.post("/movies").status_code == 409
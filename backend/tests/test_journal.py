@@ -0,0 +1,44 @@
+import os
+import threading
+import time
+
+from mvorganizer import journal
+from mvorganizer.config import get_config
+from mvorganizer.filesystem import get_filesystem
+
+
+def test_pending_disk_work_leaves_writes_free(client, library, monkeypatch):
+    monkeypatch.setitem(get_config(), "fs_write_behind", True)
+    open(os.path.join(library["imports"], "[Acme] Film.mp4"), "w").close()
+
+    movie = client.post("/movies", params={"create_properties": True}).json()
+    category = client.post("/categories", json={"name": "Drama"}).json()
+    params = {"movie_id": movie[0]["id"], "category_id": category["id"]}
+
+    filesystem = get_filesystem()
+    symlink = filesystem.symlink
+    linking = threading.Event()
+
+    def slow_symlink(*args):
+        linking.set()
+        time.sleep(1)
+        symlink(*args)
+
+    monkeypatch.setattr(filesystem, "symlink", slow_symlink)
+    response = client.post("/movies/movie_category/", params=params)
+    assert response.status_code == 200
+
+    worker = threading.Thread(target=journal.apply_pending)
+    worker.start()
+    assert linking.wait(5)
+
+    started = time.monotonic()
+    response = client.delete("/movies/movie_category/", params=params)
+    elapsed = time.monotonic() - started
+    worker.join()
+
+    assert response.status_code == 200
+    assert elapsed < 0.5
+
+    journal.apply_pending()
+    assert os.listdir(os.path.join(library["categories"])) == []
@@ -0,0 +1,140 @@
+import os
+import random
+import re
+from itertools import product
+
+import pytest
+from mvorganizer.utils import parse_filename
+
+# the expression parse_filename used before the tokenizer, kept as the
+# reference implementation for the differential check
+LEGACY_FILENAME_REGEX = re.compile(
+    r"^"  # Start of line
+    r"(?:\[([A-Za-z0-9 .,\'-]+)\])?"  # Optional studio
+    r" ?"  # Optional space
+    r"(?:{([A-Za-z0-9 .,\'-]+?)(?: ([0-9]+))?})?"  # Optional series name/#
+    r" ?"  # Optional space
+    r"([A-Za-z0-9 .,\'-]+?)?"  # Optional novie Name
+    r" ?"  # Optional space
+    r"(?:\(([A-Za-z0-9 .,\'-]+)\))?"  # Optional actor list
+    r"$"  # End of line
+)
+
+FILENAME_PARTS = (
+    "",
+    " ",
+    "  ",
+    "[Studio]",
+    "[Studio X.]",
+    "[]",
+    "[Studio",
+    "{Series 1}",
+    "{Series}",
+    "{ 1}",
+    "{Series 1 2}",
+    "{Series a1}",
+    "{}",
+    "{Series ",
+    "Name",
+    " Name ",
+    "N",
+    "(Actor A, Actor B)",
+    "()",
+    "(Actor A",
+    " (Actor A)",
+    "(A)(B)",
+    "_",
+    "\n",
+)
+
+FILENAME_ALPHABET = "[]{}() a1,.'-_\n"
+
+SEED = 0
+
+# random filenames of each kind
+SIZE = 20000
+
+
+def legacy_parse_filename(filename: str):
+    name, _ = os.path.splitext(filename)
+    matches = LEGACY_FILENAME_REGEX.search(name)
+
+    if matches is None:
+        return (name, None, None, None, None)
+
+    (
+        studio_name,
+        series_name,
+        series_number,
+        name,
+        actor_names,
+    ) = matches.groups()
+
+    return (name, studio_name, series_name, series_number, actor_names)
+
+
+def mismatches(filenames):
+    return [
+        filename
+        for filename in filenames
+        if parse_filename(filename) != legacy_parse_filename(filename)
+    ]
+
+
+@pytest.mark.parametrize(
+    "filename",
+    [
+        "",
+        ".mp4",
+        "Name",
+        "Name.mp4",
+        "Name.part.mp4",
+        "[Studio] {Series 2} Name (Actor A, Actor B).mp4",
+        "[Studio]{Series 2}Name(Actor A).mp4",
+        "{Series 10} Name.mp4",
+        "{Series} Name.mp4",
+        "[Studio] (Actor A).mp4",
+        "(Actor A).mp4",
+        "[Studio].mp4",
+        "[Studio] {Series 2}.mp4",
+        "Name (Actor A) (Actor B).mp4",
+        "Name_With_Underscores.mp4",
+        "Name\n.mp4",
+        " Name .mp4",
+        "[Studio] Name .mp4",
+        "[St[udio] Name.mp4",
+        "Name's, Part-2.mp4",
+    ],
+)
+def test_matches_legacy_on_edge_cases(filename):
+    assert parse_filename(filename) == legacy_parse_filename(filename)
+
+
+def test_matches_legacy_on_part_combinations():
+    filenames = [
+        "".join(parts) + ".mp4" for parts in product(FILENAME_PARTS, repeat=3)
+    ]
+
+    assert mismatches(filenames) == []
+
+
+def test_matches_legacy_on_random_parts():
+    rng = random.Random(SEED)
+    filenames = [
+        "".join(rng.choice(FILENAME_PARTS) for _ in range(rng.randint(0, 6)))
+        for _ in range(SIZE)
+    ]
+
+    assert mismatches(filenames) == []
+
+
+def test_matches_legacy_on_random_characters():
+    rng = random.Random(SEED)
+    filenames = [
+        "".join(
+            rng.choice(FILENAME_ALPHABET) for _ in range(rng.randint(0, 16))
+        )
+        for _ in range(SIZE)
+    ]
+
+    assert mismatches(filenames) == []
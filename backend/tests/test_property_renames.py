@@ -0,0 +1,34 @@
+import errno
+import os
+
+import pytest
+from mvorganizer.filesystem import get_filesystem
+
+
+@pytest.mark.parametrize("tree", ["categories", "series", "studios"])
+def test_failed_rename_keeps_name(client, library, monkeypatch, tree):
+    created = client.post(f"/{tree}", json={"name": "Drama"}).json()
+    os.makedirs(os.path.join(library[tree], "Drama"))
+
+    def rename(*args):
+        raise OSError(errno.EACCES, os.strerror(errno.EACCES))
+
+    monkeypatch.setattr(get_filesystem(), "rename", rename)
+
+    response = client.put(f"/{tree}/{created['id']}", json={"name": "Dramas"})
+
+    assert response.status_code == 500
+    assert client.get(f"/{tree}/{created['id']}").json()["name"] == "Drama"
+    assert os.listdir(library[tree]) == ["Drama"]
+
+
+@pytest.mark.parametrize("tree", ["categories", "series", "studios"])
+def test_rename_moves_directory(client, library, tree):
+    created = client.post(f"/{tree}", json={"name": "Drama"}).json()
+    os.makedirs(os.path.join(library[tree], "Drama"))
+
+    response = client.put(f"/{tree}/{created['id']}", json={"name": "Dramas"})
+
+    assert response.status_code == 200
+    assert client.get(f"/{tree}/{created['id']}").json()["name"] == "Dramas"
+    assert os.listdir(library[tree]) == ["Dramas"]
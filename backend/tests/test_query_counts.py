@@ -0,0 +1,125 @@
+import os
+
+import pytest
+from mvorganizer import models, utils
+from mvorganizer.base_db import SessionLocal
+
+# actors and categories on the large movie
+SIZE = 50
+
+# most queries each movie endpoint may issue, whatever the movie holds
+QUERY_BUDGETS = {
+    "GET /movies": 1,
+    "GET /movies/{id}": 3,
+    "PUT /movies/{id}": 9,
+    "POST /movies/movie_actor/": 9,
+    "DELETE /movies/movie_actor/": 8,
+    "POST /movies/movie_category/": 8,
+    "DELETE /movies/movie_category/": 8,
+}
+
+
+def add_movies(library):
+    studio = models.Studio(name="Studio", sort_name="studio")
+    series = models.Series(name="Series", sort_name="series")
+    actors = [models.Actor(name=f"Actor {i}") for i in range(SIZE + 1)]
+    categories = [
+        models.Category(name=f"Category {i}") for i in range(SIZE + 1)
+    ]
+    movies = {}
+
+    for label, count in (("small", 1), ("large", SIZE)):
+        movies[label] = models.Movie(
+            filename=f"{label}.mp4",
+            name=label,
+            sort_name=label,
+            studio=studio,
+            series=series,
+            actors=actors[:count],
+            categories=categories[:count],
+        )
+        open(os.path.join(library["movies"], f"{label}.mp4"), "w").close()
+
+    other_series = models.Series(name="Other", sort_name="other")
+    other_studio = models.Studio(name="Other", sort_name="other")
+
+    with SessionLocal() as db:
+        db.add_all(actors + categories + list(movies.values()))
+        db.add_all([other_series, other_studio])
+        db.commit()
+
+        for movie in movies.values():
+            utils.rename_movie_file(movie)
+
+        db.commit()
+
+        return (
+            {label: movie.id for label, movie in movies.items()},
+            {
+                "actor_id": actors[-1].id,
+                "category_id": categories[-1].id,
+                "series_id": other_series.id,
+                "studio_id": other_studio.id,
+            },
+        )
+
+
+def request(client, endpoint, movie_id, extra):
+    method, path = endpoint.split(" ")
+    path = path.replace("{id}", str(movie_id))
+
+    if method == "PUT":
+        body = {
+            "name": f"Movie {movie_id} Renamed",
+            "series_id": extra["series_id"],
+            "series_number": 2,
+            "studio_id": extra["studio_id"],
+        }
+        return client.request(method, path, json=body)
+
+    if "movie_actor" in path:
+        params = {"movie_id": movie_id, "actor_id": extra["actor_id"]}
+    elif "movie_category" in path:
+        params = {"movie_id": movie_id, "category_id": extra["category_id"]}
+    else:
+        params = None
+
+    return client.request(method, path, params=params)
+
+
+@pytest.fixture
+def query_counts(client, library, queries):
+    movie_ids, extra = add_movies(library)
+    counts = {}
+
+    for endpoint in QUERY_BUDGETS:
+        counts[endpoint] = {}
+
+        for label, movie_id in movie_ids.items():
+            del queries[:]
+            response = request(client, endpoint, movie_id, extra)
+
+            assert response.status_code == 200
+            counts[endpoint][label] = len(queries)
+
+    return counts
+
+
+def test_within_budget(query_counts):
+    over = {
+        endpoint: counts
+        for endpoint, counts in query_counts.items()
+        if max(counts.values()) > QUERY_BUDGETS[endpoint]
+    }
+
+    assert over == {}
+
+
+def test_does_not_grow_with_movie(query_counts):
+    grows = {
+        endpoint: counts
+        for endpoint, counts in query_counts.items()
+        if counts["large"] > counts["small"]
+    }
+
+    assert grows == {}
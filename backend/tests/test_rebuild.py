@@ -0,0 +1,57 @@
+from mvorganizer import models
+from mvorganizer.base_db import create_sqlite_engine
+from mvorganizer.rebuild import copy_import_history
+from sqlalchemy import select
+
+
+def create_database(path, movies):
+    engine = create_sqlite_engine(str(path))
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as connection:
+        for movie_id, filename in movies:
+            connection.execute(
+                models.Movie.__table__.insert(),
+                {
+                    "id": movie_id,
+                    "filename": filename,
+                    "name": filename,
+                    "sort_name": filename,
+                },
+            )
+
+    return engine
+
+
+def test_pending_journal_entries_survive_a_rebuild(tmp_path):
+    live = create_database(tmp_path / "movies.db", [(7, "a.mp4")])
+    shadow = create_database(tmp_path / "shadow.db", [(1, "a.mp4")])
+
+    with live.begin() as connection:
+        connection.execute(
+            models.FilesystemJournal.__table__.insert(),
+            [
+                {"id": 3, "movie_id": 7, "plan": "{}", "status": "pending"},
+                {"id": 4, "movie_id": None, "plan": "{}", "status": "failed"},
+            ],
+        )
+
+    live.dispose()
+
+    with shadow.connect() as connection:
+        copy_import_history(connection, str(tmp_path / "movies.db"))
+
+        entries = connection.execute(
+            select(
+                models.FilesystemJournal.id,
+                models.FilesystemJournal.movie_id,
+                models.FilesystemJournal.status,
+            ).order_by(models.FilesystemJournal.id)
+        ).all()
+
+    shadow.dispose()
+
+    assert [tuple(entry) for entry in entries] == [
+        (3, 1, "pending"),
+        (4, None, "failed"),
+    ]
@@ -0,0 +1,72 @@
+import os
+import time
+
+import pytest
+from mvorganizer import journal
+from mvorganizer.config import get_config
+from mvorganizer.watcher import ImportWatcher
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+
+    return condition()
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_deleted_movie_is_not_imported_again(
+    client, library, monkeypatch, write_behind
+):
+    monkeypatch.setitem(get_config(), "fs_write_behind", write_behind)
+    open(os.path.join(library["imports"], "[Acme] Film.mp4"), "w").close()
+
+    movie = client.post("/movies", params={"create_properties": True}).json()
+    os.rename(
+        os.path.join(library["imports"], "[Acme] Film.mp4"),
+        os.path.join(library["movies"], "[Acme] Film.mp4"),
+    )
+
+    watcher = ImportWatcher(library["imports"], debounce=0.1)
+    watcher.start()
+
+    try:
+        response = client.delete(f"/movies/{movie[0]['id']}")
+        assert response.status_code == 200
+        journal.apply_pending()
+
+        # a file the user drops in afterwards still gets picked up
+        open(os.path.join(library["imports"], "[Acme] Other.mp4"), "w").close()
+        assert wait_for(lambda: len(client.get("/movies").json()) == 1)
+        time.sleep(0.5)
+    finally:
+        watcher.stop()
+
+    movies = client.get("/movies").json()
+    assert [movie["filename"] for movie in movies] == ["[Acme] Other.mp4"]
+    assert "[Acme] Film.mp4" in os.listdir(library["imports"])
+
+
+def test_files_arriving_during_catch_up_scan_are_imported(
+    client, library, monkeypatch
+):
+    open(os.path.join(library["imports"], "[Acme] Film.mp4"), "w").close()
+
+    watcher = ImportWatcher(library["imports"], debounce=0.1)
+    import_new_files = watcher.import_new_files
+
+    def scan_during_arrival():
+        import_new_files()
+        open(os.path.join(library["imports"], "[Acme] Late.mp4"), "w").close()
+
+    monkeypatch.setattr(watcher, "import_new_files", scan_during_arrival)
+    watcher.start()
+
+    try:
+        assert wait_for(lambda: len(client.get("/movies").json()) == 2)
+    finally:
+        watcher.stop()
@@ -1,31 +1,78 @@
 import { useState } from "react";
 
+import { ImportRecordType, ImportSummaryType } from "../types/api";
+
+const formatSummary = (summary: ImportSummaryType) => {
+  if (summary.total === 0) {
+    return "No movies were available for import";
+  }
+
+  const skipped = summary.total - summary.imported;
+
+  return skipped === 0
+    ? `Imported ${summary.imported} movie files`
+    : `Imported ${summary.imported} movie files, skipped ${skipped}`;
+};
+
 const AdminImportMovies = () => {
   const [importStatus, setImportStatus] = useState("");
+  const [importErrors, setImportErrors] = useState<ImportRecordType[]>([]);
 
   const onImportMovies = async () => {
+    setImportStatus("");
+    setImportErrors([]);
+
     const response = await fetch(
-      `${process.env.REACT_APP_BACKEND_URI}/movies`,
+      `${process.env.REACT_APP_BACKEND_URI}/movies/stream`,
       {
         method: "POST",
         headers: {
-          "Content-Type": "application/json",
-          Accept: "application/json",
+          Accept: "application/x-ndjson",
         },
       }
     );
-    const data = await response.json();
 
-    if (response.ok) {
-      const count = data.length;
+    if (!response.ok || response.body === null) {
+      const data = await response.json();
+      setImportStatus(data.detail.message);
+      return;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let imported = 0;
 
-      if (count === 0) {
-        setImportStatus("No movies were available for import");
-      } else {
-        setImportStatus(`Imported ${count} movie files`);
+    // records arrive one per line, render progress as each batch lands
+    while (true) {
+      const { done, value } = await reader.read();
+
+      if (done) {
+        break;
+      }
+
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split("\n");
+      buffer = lines.pop() ?? "";
+
+      const errors: ImportRecordType[] = [];
+
+      for (const line of lines.filter((line) => line.length > 0)) {
+        const record: ImportRecordType | ImportSummaryType = JSON.parse(line);
+
+        if (record.status === "summary") {
+          setImportStatus(formatSummary(record));
+        } else if (record.status === "imported") {
+          imported += 1;
+          setImportStatus(`Imported ${imported} movie files...`);
+        } else {
+          errors.push(record);
+        }
+      }
+
+      if (errors.length > 0) {
+        setImportErrors((current) => [...current, ...errors]);
       }
-    } else {
-      setImportStatus(data.detail.message);
     }
   };
 
@@ -41,6 +88,15 @@ const AdminImportMovies = () => {
         </button>
       </div>
       {importStatus && <div>{importStatus}</div>}
+      {importErrors.length > 0 && (
+        <ul className="text-left text-sm">
+          {importErrors.map((record) => (
+            <li key={record.filename}>
+              {record.filename}: {record.message}
+            </li>
+          ))}
+        </ul>
+      )}
     </div>
   );
 };
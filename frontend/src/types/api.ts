@@ -30,3 +30,19 @@ export interface MovieFileType {
 
 export interface SeriesType extends BaseMovieProperty {}
 export interface StudioType extends BaseMovieProperty {}
+
+export interface ImportRecordType {
+  filename: string;
+  status: "imported" | "duplicate" | "parse_error" | "path_error";
+  id?: number;
+  message?: string;
+}
+
+export interface ImportSummaryType {
+  status: "summary";
+  total: number;
+  imported: number;
+  duplicate: number;
+  parse_error: number;
+  path_error: number;
+}